@@ -0,0 +1,89 @@
+###
+##  Django Proxypay Benchmarks, Import Time
+#
+#   Imports proxypay.models under configured settings in a fresh interpreter with
+#   python -X importtime, reports the cumulative import time of proxypay.models and checks
+#   that the HTTP clients (requests, urllib3, httpx) are not imported, the API clients
+#   being built on the first Proxypay call. Exits with an error if one of them is imported
+#
+#   python benchmarks/importtime.py
+#   python benchmarks/importtime.py --repeat 10 --json
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# not needed to load the app, imported with the first Proxypay call
+DEFERRED = ('requests', 'urllib3', 'httpx')
+
+CODE = f"""
+import json, sys
+import django
+from django.apps import config
+from django.conf import settings
+
+# -X importtime only times the import statement (__import__), not importlib.import_module
+# used by django.setup to load the apps and their models
+def import_module(name, package=None):
+    __import__(name)
+    return sys.modules[name]
+
+config.import_module = import_module
+
+settings.configure(
+    INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'proxypay'],
+    DATABASES={{'default': {{'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}}}},
+    PROXYPAY={{'PRIVATE_KEY': 'benchmarks', 'ENTITY': '12345', 'ENV': 'sandbox'}},
+)
+django.setup()
+import proxypay.models
+print(json.dumps(sorted(name for name in {DEFERRED!r} if name in sys.modules)))
+"""
+
+# ==============================================================================================
+
+def measure():
+    """Cumulative import time of each module (microseconds) and the deferred modules imported"""
+
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', CODE],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    # import time: self [us] | cumulative | imported package
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _self, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+    return times, json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='django proxypay import time')
+    parser.add_argument('--repeat', type=int, default=5, help='interpreters started, the median is reported')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+
+    runs     = [measure() for _ in range(args.repeat)]
+    imported = sorted({name for _times, deferred in runs for name in deferred})
+    results  = {
+        module: statistics.median(times.get(module, 0) for times, _deferred in runs) / 1000
+        for module in ('django', 'proxypay', 'proxypay.models', 'proxypay.api')
+    }
+
+    if args.json:
+        print(json.dumps({'cumulative_ms': results, 'deferred_imported': imported}, indent=2))
+    else:
+        for module, milliseconds in results.items():
+            print(f"{module:<20} {milliseconds:8.1f}ms cumulative")
+        print(f"deferred imports     {', '.join(imported) or 'none'} of {', '.join(DEFERRED)}")
+    if imported:
+        sys.exit(f"importing proxypay.models imports {', '.join(imported)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+###
+##  Django Proxypay Benchmarks, Reference Lookup Query Plans
+#
+#   Loads a references table of --rows rows (1 000 000 by default), most of them paid or
+#   expired, and checks the query plans of the reference lookup hot path,
+#   ReferenceModelManager.is_available, available and get_reference: they must search
+#   proxypay_ref_lookup_idx or proxypay_ref_waiting_idx, not scan the table.
+#   Also times each lookup. Exits with an error when a plan doesn't use the indexes
+#
+#   python benchmarks/query_plans.py
+#   python benchmarks/query_plans.py --rows 100000 --database /tmp/references.sqlite3
+
+import argparse
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run import setup_django
+
+INDEXES = ('proxypay_ref_lookup_idx', 'proxypay_ref_waiting_idx')
+# plan lines of full table scans, sqlite and postgresql
+SCANS   = ('SCAN proxypay_reference', 'SCAN TABLE proxypay_reference', 'Seq Scan on proxypay_reference')
+
+# ==============================================================================================
+
+def load(rows, batch_size=20000):
+    """Inserts <rows> references, 1 in 10 waiting, with raw inserts (bulk_create is too slow for millions)"""
+
+    from django.db import connection, transaction
+    from django.utils.timezone import now
+    from proxypay.models import Reference, PAYMENT_STATUS_PAID, PAYMENT_STATUS_WAITING
+
+    fields    = [field for field in Reference._meta.concrete_fields if not field.primary_key]
+    prototype = Reference(reference='0', amount=1000, fields={}, data={}, payment=None)
+    prototype.created_at = prototype.updated_at = now()
+    values    = {field.attname: field.get_db_prep_save(getattr(prototype, field.attname), connection) for field in fields}
+    columns   = [field.column for field in fields]
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(Reference._meta.db_table),
+        ', '.join(connection.ops.quote_name(column) for column in columns),
+        ', '.join(['%s'] * len(columns))
+    )
+
+    future, past = now() + datetime.timedelta(days=2), now() - datetime.timedelta(days=2)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, rows, batch_size):
+            batch = []
+            for i in range(start, min(start + batch_size, rows)):
+                waiting = i % 10 == 0
+                values.update({
+                    'reference': str(100000000 + i % 900000000),
+                    'key': f"bench-{i}",
+                    'status': PAYMENT_STATUS_WAITING if waiting else PAYMENT_STATUS_PAID,
+                    'expires_in': Reference._meta.get_field('expires_in').get_db_prep_save(
+                        future if waiting and i % 20 == 0 else past, connection
+                    ),
+                })
+                batch.append([values[field.attname] for field in fields])
+            cursor.executemany(sql, batch)
+    if connection.vendor in ('sqlite', 'postgresql'):
+        # planner statistics, as in a long lived database
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+def check(name, queryset, run, repeat=200):
+    plan = queryset.explain()
+    started = time.perf_counter()
+    for _ in range(repeat):
+        run()
+    elapsed = (time.perf_counter() - started) / repeat
+    index   = next((index for index in INDEXES if index in plan), None)
+    scans   = [line for line in plan.splitlines() if any(scan in line for scan in SCANS)]
+    ok      = index is not None and not scans
+    print(f"{'ok  ' if ok else 'FAIL'} {name:<16} {elapsed * 1000:8.3f}ms  {index or 'no lookup index'}")
+    if not ok:
+        print('     ' + plan.replace('\n', '\n     '))
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description='django proxypay reference lookup query plans')
+    parser.add_argument('--rows', type=int, default=1000000, help='references loaded')
+    parser.add_argument('--database', default=':memory:', help='sqlite database file')
+    args = parser.parse_args()
+
+    setup_django('http://127.0.0.1:9', database=args.database)
+    from django.utils.timezone import now
+    from proxypay.models import Reference, PAYMENT_STATUS_WAITING
+
+    started = time.perf_counter()
+    load(args.rows)
+    print(f"{args.rows} references loaded in {time.perf_counter() - started:.1f}s")
+
+    reference  = str(100000000 + (args.rows // 2 // 20) * 20)
+    references = [str(100000000 + i) for i in range(0, args.rows, max(args.rows // 100, 1))]
+    lookup     = {'status': PAYMENT_STATUS_WAITING, 'expires_in__gt': now()}
+    results = [
+        check(
+            'is_available', Reference.objects.filter(reference=reference, **lookup),
+            lambda: Reference.objects.is_available(reference)
+        ),
+        check(
+            'available', Reference.objects.filter(reference__in=references, **lookup),
+            lambda: Reference.objects.available(references)
+        ),
+        check(
+            'get_reference', Reference.objects.filter(reference=reference, **lookup).order_by('pk')[:1],
+            lambda: Reference.objects.get_reference(reference)
+        ),
+    ]
+    if not all(results):
+        sys.exit('reference lookups are not using the lookup indexes')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+###
+##  Django Proxypay Benchmarks
+#
+#   Offline throughput benchmarks, against a local Proxypay stub (benchmarks/stub.py)
+#   and an in memory sqlite database:
+#   * references created per second, with references.create and references.create_many
+#   * webhook payments applied per second, through proxypay.views.watch_payments
+#   * payments checked per second, with Reference.check_payment
+#   * reconciliation time of the /payments backlog as it grows, with proxypay.payments.reconcile
+#   * per call latency percentiles of the pooled transport against an unpooled one, opening a new
+#     connection per call like the module level requests.get/post calls used before the pooling
+#
+#   python benchmarks/run.py
+#   python benchmarks/run.py --latency 0.005 --calls 1000
+#   python benchmarks/run.py --latency 0.02 --references 500 --backlogs 100 1000 5000
+#   python benchmarks/run.py --transport urllib3
+#   python benchmarks/run.py --json > before.json
+
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub import ProxypayStub
+
+PRIVATE_KEY = 'benchmarks'
+
+# ==============================================================================================
+
+def setup_django(url, transport='requests', database=':memory:'):
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.configure(
+        DEBUG=False,
+        SECRET_KEY='benchmarks',
+        USE_TZ=True,
+        INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth', 'proxypay'],
+        # database queries are made by the main thread only, one in memory database
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': database}},
+        CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+        PROXYPAY={
+            'PRIVATE_KEY': PRIVATE_KEY,
+            'ENTITY': '12345',
+            'ENV': 'sandbox',
+            'API_SANDBOX_BASE_URL': url,
+            'TRANSPORT': transport,
+        }
+    )
+    django.setup()
+    call_command('migrate', verbosity=0)
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result  = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def rate(count, elapsed):
+    return count / elapsed if elapsed else float('inf')
+
+def new_references(count, concurrency):
+    from proxypay.references import create_many
+
+    references, failures = create_many([{'amount': 1000 + i} for i in range(count)], concurrency=concurrency)
+    if failures:
+        raise RuntimeError(f"{len(failures)} references not created: {failures[0][1]!r}")
+    return references
+
+# ==============================================================================================
+
+def bench_create(count, concurrency):
+    from proxypay.references import create
+
+    _, elapsed = timed(lambda: [create(1000 + i) for i in range(count)])
+    _, elapsed_many = timed(new_references, count, concurrency)
+    return {
+        'create_per_second': rate(count, elapsed),
+        'create_many_per_second': rate(count, elapsed_many),
+    }
+
+def bench_webhooks(count, concurrency):
+    from django.test import RequestFactory
+    from proxypay.views import watch_payments
+
+    factory = RequestFactory()
+    bodies  = []
+    for reference in new_references(count, concurrency):
+        payment = {
+            'id': 10 ** 9 + reference.pk,
+            'reference_id': reference.reference,
+            'amount': str(reference.amount),
+            'datetime': '2026-01-01T10:00:00.000Z',
+            'custom_fields': reference.fields
+        }
+        body = json.dumps(payment).encode()
+        bodies.append((body, hmac.new(PRIVATE_KEY.encode(), body, hashlib.sha256).hexdigest()))
+
+    def apply():
+        for body, signature in bodies:
+            response = watch_payments(factory.post(
+                '/', data=body, content_type='application/json', HTTP_X_SIGNATURE=signature
+            ))
+            if response.status_code != 200:
+                raise RuntimeError(f"webhook returned {response.status_code}")
+
+    _, elapsed = timed(apply)
+    return {'webhooks_per_second': rate(count, elapsed)}
+
+def bench_check_payment(stub, count, concurrency):
+    references = new_references(count, concurrency)
+
+    def check():
+        for reference in references:
+            stub.add_payment(reference.reference, reference.amount, reference.fields)
+            if not reference.check_payment():
+                raise RuntimeError(f"payment of {reference.reference} not found")
+
+    _, elapsed = timed(check)
+    return {'check_payment_per_second': rate(count, elapsed)}
+
+def bench_reconcile(stub, backlogs, concurrency):
+    from proxypay.payments import reconcile
+
+    results = []
+    for backlog in backlogs:
+        for reference in new_references(backlog, concurrency):
+            stub.add_payment(reference.reference, reference.amount, reference.fields)
+
+        def drain():
+            matched, cycles = 0, 0
+            # Proxypay returns the backlog by pages, reconcile until it's empty
+            while stub.payments and cycles <= backlog:
+                summary = reconcile(concurrency=concurrency)
+                matched += len(summary['matched'])
+                cycles  += 1
+            return matched, cycles
+
+        (matched, cycles), elapsed = timed(drain)
+        if matched != backlog:
+            raise RuntimeError(f"{matched} of {backlog} payments reconciled")
+        results.append({
+            'backlog': backlog,
+            'cycles': cycles,
+            'seconds': elapsed,
+            'payments_per_second': rate(backlog, elapsed),
+        })
+    return {'reconcile': results}
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p50_ms': cuts[49] * 1000,
+        'p90_ms': cuts[89] * 1000,
+        'p99_ms': cuts[98] * 1000,
+    }
+
+def bench_latency(count):
+    import requests
+    from proxypay.api import ProxypayAPI
+    from proxypay.transports import RequestsTransport
+
+    class UnpooledTransport(RequestsTransport):
+
+        """New connection per call, like the module level requests.* calls made before the pooled session"""
+
+        def request(self, method, path, json=None, params=None, timeout=None):
+            with requests.request(
+                method, f"{self.base_url}{path}", json=json, params=params,
+                headers=self.headers, timeout=self.get_timeout(timeout)
+            ) as r:
+                return r
+
+    pooled   = ProxypayAPI()
+    unpooled = ProxypayAPI(transport=UnpooledTransport(
+        pooled.transport.base_url, pooled.transport.headers, timeout=pooled.timeout
+    ))
+
+    def measure(api):
+        samples = []
+        for _ in range(count):
+            started = time.perf_counter()
+            if not api.get_reference_id():
+                raise RuntimeError('reference id not generated')
+            samples.append(time.perf_counter() - started)
+        return percentiles(samples)
+
+    results = {}
+    for name, api in (('unpooled', unpooled), ('pooled', pooled)):
+        # first call opens the pooled connection, not measured
+        api.get_reference_id()
+        results[name] = measure(api)
+        api.close()
+    return {'call_latency': results}
+
+# ==============================================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description='django proxypay offline benchmarks')
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every stub request')
+    parser.add_argument('--references', type=int, default=200, help='references created, paid and checked')
+    parser.add_argument('--backlogs', type=int, nargs='+', default=[100, 500, 1000], help='reconcile backlog sizes')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--calls', type=int, default=200, help='calls timed for the latency percentiles, 0 skips them')
+    parser.add_argument('--transport', default='requests', help='PROXYPAY TRANSPORT: requests, urllib3 or httpx')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+
+    stub = ProxypayStub(latency=args.latency).start()
+    try:
+        setup_django(stub.url, args.transport)
+        results = {'transport': args.transport, 'latency': args.latency, 'references': args.references, 'concurrency': args.concurrency}
+        results.update(bench_create(args.references, args.concurrency))
+        results.update(bench_webhooks(args.references, args.concurrency))
+        results.update(bench_check_payment(stub, args.references, args.concurrency))
+        results.update(bench_reconcile(stub, args.backlogs, args.concurrency))
+        if args.calls:
+            results.update(bench_latency(args.calls))
+    finally:
+        stub.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"transport: {args.transport}, stub latency: {args.latency * 1000:.1f}ms, references: {args.references}, concurrency: {args.concurrency}")
+    print(f"references.create          {results['create_per_second']:10.1f} references/s")
+    print(f"references.create_many     {results['create_many_per_second']:10.1f} references/s")
+    print(f"watch_payments             {results['webhooks_per_second']:10.1f} webhooks/s")
+    print(f"Reference.check_payment    {results['check_payment_per_second']:10.1f} payments/s")
+    for result in results['reconcile']:
+        print(
+            f"reconcile backlog {result['backlog']:>7} {result['seconds']:10.3f}s "
+            f"({result['cycles']} cycles, {result['payments_per_second']:.1f} payments/s)"
+        )
+    for name, result in results.get('call_latency', {}).items():
+        print(
+            f"call latency {name:<13} mean {result['mean_ms']:7.2f}ms  p50 {result['p50_ms']:7.2f}ms  "
+            f"p90 {result['p90_ms']:7.2f}ms  p99 {result['p99_ms']:7.2f}ms"
+        )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+###
+##  Django Proxypay Benchmarks, Proxypay Stub Server
+#
+#   Local HTTP server in front of the in memory Proxypay of the tests (proxypay.transports.FakeProxypay),
+#   for offline benchmarks: the Proxypay v2 endpoints used by django proxypay are served by
+#   FakeProxypay.handle, this module only adds the HTTP layer.
+#   Every request waits <latency> seconds, to simulate the network round trip
+
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from proxypay.transports import FakeProxypay
+
+# ==============================================================================================
+
+class ProxypayStub:
+
+    """
+    Proxypay stub server, in a background thread:
+
+        with ProxypayStub(latency=0.02) as stub:
+            PROXYPAY['API_SANDBOX_BASE_URL'] = stub.url
+    """
+
+    def __init__(self, latency: float = 0, host: str = '127.0.0.1', port: int = 0):
+        self.latency  = latency
+        self.lock     = threading.Lock()
+        self.proxypay = FakeProxypay()
+        self.requests = 0
+        self.server   = ThreadingHTTPServer((host, port), self.get_handler())
+        self.server.daemon_threads = True
+        self.thread   = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def payments(self):
+        """Payments not yet acknowledged, by id"""
+        return self.proxypay.payments
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    # ==========================================================
+
+    def add_payment(self, reference_id, amount=None, custom_fields=None):
+        """Adds a payment not yet acknowledged, as made at an ATM, and returns it"""
+        return self.proxypay.add_payment(reference_id, amount, custom_fields)
+
+    def get_handler(self):
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version        = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, status, body=None):
+                data = json.dumps(body).encode() if body is not None else b''
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except ConnectionError:
+                    # the client gave up, timeout or deadline
+                    self.close_connection = True
+
+            def read(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'null')
+
+            def handle_request(self, method):
+                body = self.read()
+                with stub.lock:
+                    stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+
+                url = urlparse(self.path)
+                self.send(*stub.proxypay.handle(method, url.path, json=body, params=dict(parse_qsl(url.query))))
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def do_PUT(self):
+                self.handle_request('PUT')
+
+            def do_DELETE(self):
+                self.handle_request('DELETE')
+
+        return Handler
+
+# ==============================================================================================
+
+if __name__ == '__main__':
+    import argparse
+
+    from django.conf import settings
+
+    parser = argparse.ArgumentParser(description='Proxypay v2 stub server')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every request')
+    args = parser.parse_args()
+
+    # payment dates of FakeProxypay
+    settings.configure(USE_TZ=True)
+
+    stub = ProxypayStub(latency=args.latency, port=args.port)
+    print(f"Proxypay stub listening on {stub.url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
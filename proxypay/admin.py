@@ -1,10 +1,18 @@
 from django import forms
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.core.exceptions import ValidationError
+from django.db.models.fields.json import KeyTextTransform, KeyTransform
+from django.http import StreamingHttpResponse
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django_admin_display import admin_display as d
 
+from proxypay import export
+from proxypay.configs import conf
 from proxypay.utils import str_to_datetime
-from proxypay.models import Reference
+from proxypay.models import Reference, JSON_KEYS
+from proxypay.paginators import LargeTablePaginator
 from proxypay.references import create
 
 # --------------------------------------------------------------------------------------------
@@ -63,6 +71,64 @@ LIST_RAW_DATA = (
     'data'
 )
 
+# Changelist columns, loaded with .only() in large table mode
+LIST_DISPLAY_COLUMNS = (
+    'pk',
+    'reference',
+    'entity',
+    'amount',
+    'net_amount',
+    'fees_expense',
+    'bank_fee',
+    'proxypay_fee',
+    'created_at',
+    'paid_at',
+    'key',
+    'expires_in',
+    'status'
+)
+
+# Extra changelist columns read from JSON keys in large table mode, extracted by the database
+LIST_DISPLAY_JSON = ('product', 'service')
+
+# keyset pagination cursor of the large table mode, pk of the last reference of the previous page
+AFTER_VAR = 'after'
+
+def json_key_annotation(field, *keys):
+    expression = field
+    for key in keys[:-1]:
+        expression = KeyTransform(key, expression)
+    return KeyTextTransform(keys[-1], expression)
+
+# --------------------------------------------------------------------------------------------
+
+class LargeTableChangeList(ChangeList):
+
+    """
+    Changelist of the large table mode, the link to the next page carries the pk of the
+    last reference shown (?after=<pk>), so LargeTablePaginator seeks it instead of an OFFSET
+    """
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        # the cursor isn't a filter
+        lookup_params.pop(AFTER_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # other links (pages, sorting, filters) don't keep the cursor
+        new_params = dict(new_params or {})
+        if new_params.get(PAGE_VAR) == self.page_num + 1 and (after := self.get_next_after()) is not None:
+            new_params[AFTER_VAR] = after
+        return super().get_query_string(new_params, [*(remove or []), AFTER_VAR])
+
+    def get_next_after(self):
+        if not self.multi_page or self.show_all or not getattr(self.paginator, 'keyset_order', None):
+            return None
+        # already fetched by the results
+        references = list(self.result_list)
+        return references[-1].pk if references else None
+
 # --------------------------------------------------------------------------------------------
 
 class AddForm(forms.ModelForm):
@@ -131,108 +197,200 @@ class ReferenceAdmin(admin.ModelAdmin):
         (_('Raw Data'), {'fields': LIST_RAW_DATA }),
     )
 
-    date_hierarchy   = 'created_at'
     form = AddForm
+    actions = ('export_csv', 'export_jsonl')
+
+    # --------------------------------------------------------------------------------------------
+	###
+	## Large Table Mode, PROXYPAY['ADMIN_LARGE_TABLE_MODE']
+	#
+
+    @property
+    def large_table_mode(self):
+        return conf.ADMIN_LARGE_TABLE_MODE
+
+    @property
+    def date_hierarchy(self):
+        # the date hierarchy runs aggregate queries over the whole table
+        return None if self.large_table_mode else 'created_at'
+
+    @property
+    def show_full_result_count(self):
+        return not self.large_table_mode
+
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList if self.large_table_mode else super().get_changelist(request, **kwargs)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if self.large_table_mode:
+            try:
+                after = self.model._meta.pk.to_python(request.GET.get(AFTER_VAR) or None)
+            except ValidationError:
+                after = None
+            return LargeTablePaginator(queryset, per_page, orphans, allow_empty_first_page, after=after)
+        return super().get_paginator(request, queryset, per_page, orphans, allow_empty_first_page)
+
+    def get_list_display(self, request):
+        list_display = super().get_list_display(request)
+        # the JSON keys are extracted by the database, without loading the JSON fields
+        return (*list_display, *LIST_DISPLAY_JSON) if self.large_table_mode else list_display
+
+    def get_ordering(self, request):
+        # keyset pagination, on the primary key index
+        return ('-pk',) if self.large_table_mode else super().get_ordering(request)
+
+    def get_list_filter(self, request):
+        # the entity filter runs a SELECT DISTINCT over the whole table
+        return ('status',) if self.large_table_mode else super().get_list_filter(request)
+
+    def get_search_fields(self, request):
+        # exact, indexed, lookups instead of LIKE scans
+        return ('=key', '=reference') if self.large_table_mode else super().get_search_fields(request)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.large_table_mode and self.is_changelist(request):
+            list_display = self.get_list_display(request)
+            queryset = queryset.only(*LIST_DISPLAY_COLUMNS).annotate(**{
+                f"json_{name}": json_key_annotation(*JSON_KEYS[name])
+                for name in list_display if name in JSON_KEYS
+            })
+        return queryset
+
+    def is_changelist(self, request):
+        opts = self.model._meta
+        return getattr(request.resolver_match, 'url_name', None) == f"{opts.app_label}_{opts.model_name}_changelist"
+
+    def get_json_value(self, obj, name):
+        """Value of a JSON key, from the database annotation when available"""
+        if hasattr(obj, f"json_{name}"):
+            return getattr(obj, f"json_{name}")
+        field, *keys = JSON_KEYS[name]
+        value = getattr(obj, field)
+        for key in keys:
+            value = (value or {}).get(key)
+        return value
+
+    # --------------------------------------------------------------------------------------------
+	###
+	## Actions
+	#
+
+    def export_response(self, queryset, format, content_type):
+        response = StreamingHttpResponse(
+            export.iter_export(queryset.order_by('pk'), format),
+            content_type=content_type
+        )
+        response['Content-Disposition'] = f"attachment; filename=references-{now():%Y%m%d%H%M%S}.{format}"
+        return response
+
+    @d(short_description=_('Export selected references as CSV'))
+    def export_csv(self, request, queryset):
+        return self.export_response(queryset, 'csv', 'text/csv')
+
+    @d(short_description=_('Export selected references as JSON Lines'))
+    def export_jsonl(self, request, queryset):
+        return self.export_response(queryset, 'jsonl', 'application/x-ndjson')
 
     # --------------------------------------------------------------------------------------------
     # Payment Details
 
     @d(short_description=_('Period ID'))
     def payment_period_id(self, obj):
-        return obj.payment_data.get('period_id')
+        return self.get_json_value(obj, 'payment_period_id')
     
     @d(short_description=_('Payment Period Start At'))
     def payment_period_start_datetime(self, obj):
         return str_to_datetime(
-            obj.payment_data.get('period_start_datetime')
+            self.get_json_value(obj, 'payment_period_start_datetime')
         )
     
     @d(short_description=_('Payment Period End At'))
     def payment_period_end_datetime(self, obj):
         return str_to_datetime(
-            obj.payment_data.get('period_end_datetime')
+            self.get_json_value(obj, 'payment_period_end_datetime')
         )
 
     @d(short_description=_('Payment Location'))
     def payment_location(self, obj):
-        return obj.payment_data.get('terminal_location')
+        return self.get_json_value(obj, 'payment_location')
 
     @d(short_description=_('Payment Terminal Type'))
     def payment_tarminal_type(self, obj):
-        return obj.payment_data.get('terminal_type')
+        return self.get_json_value(obj, 'payment_tarminal_type')
     
     @d(short_description=_('Payment Terminal ID'))
     def payment_tarminal_id(self, obj):
-        return obj.payment_data.get('terminal_id')
+        return self.get_json_value(obj, 'payment_tarminal_id')
     
     @d(short_description=_('Payment Transaction ID'))
     def payment_transaction_id(self, obj):
-        return obj.payment_data.get('transaction_id')
+        return self.get_json_value(obj, 'payment_transaction_id')
     
     @d(short_description=_('Payment Product ID'))
     def payment_product_id(self, obj):
-        return obj.payment_data.get('product_id')
+        return self.get_json_value(obj, 'payment_product_id')
 
     # --------------------------------------------------------------------------------------------
     # Prouct and Service Details
 
     @d(short_description=_('Product'))
     def product(self, obj):
-        return obj.fields.get('product')
+        return self.get_json_value(obj, 'product')
     
     @d(short_description=_('Service'))
     def service(self, obj):
-        return obj.fields.get('service')
+        return self.get_json_value(obj, 'service')
 
     # --------------------------------------------------------------------------------------------
     # Bank Details
 
     @d(short_description=_('Bank Name'))
     def bank_name(self, obj):
-        return obj.bank_fee_data.get('name')
+        return self.get_json_value(obj, 'bank_name')
     
     @d(short_description=_('Bank Net Amount'))
     def bank_net_amount(self, obj):
-        return obj.bank_fee_data.get('net_amount')
+        return self.get_json_value(obj, 'bank_net_amount')
     
     @d(short_description=_('Bank Fee Percentage'))
     def bank_fee_percent(self, obj):
-        return obj.bank_fee_data.get('applied_fee')
+        return self.get_json_value(obj, 'bank_fee_percent')
     
     @d(short_description=_('Bank Fee Amount'))
     def bank_fee_amount(self, obj):
-        return obj.bank_fee_data.get('fee_amount')
+        return self.get_json_value(obj, 'bank_fee_amount')
     
     @d(short_description=_('Bank Applied Min Amount'))
     def bank_fee_min_amount(self, obj):
-        return obj.bank_fee_data.get('applied_min_amount') or _('Not Applied')
+        return self.get_json_value(obj, 'bank_fee_min_amount') or _('Not Applied')
     
     @d(short_description=_('Bank Applied Max Amount'))
     def bank_fee_max_amount(self, obj):
-        return obj.bank_fee_data.get('applied_max_amount') or _('Not Applied')
+        return self.get_json_value(obj, 'bank_fee_max_amount') or _('Not Applied')
     
     # --------------------------------------------------------------------------------------------
     # Proxypay Details
     
     @d(short_description=_('Net Amount'))
     def proxypay_net_amount(self, obj):
-        return obj.proxypay_fee_data.get('net_amount')
+        return self.get_json_value(obj, 'proxypay_net_amount')
     
     @d(short_description=_('Fee Percentage'))
     def proxypay_fee_percent(self, obj):
-        return obj.proxypay_fee_data.get('applied_fee')
+        return self.get_json_value(obj, 'proxypay_fee_percent')
     
     @d(short_description=_('Fee Amount'))
     def proxypay_fee_amount(self, obj):
-        return obj.proxypay_fee_data.get('fee_amount')
+        return self.get_json_value(obj, 'proxypay_fee_amount')
     
     @d(short_description=_('Applied Min Amount'))
     def proxypay_fee_min_amount(self, obj):
-        return obj.proxypay_fee_data.get('applied_min_amount') or _('Not Applied')
+        return self.get_json_value(obj, 'proxypay_fee_min_amount') or _('Not Applied')
     
     @d(short_description=_('Applied Max Amount'))
     def proxypay_fee_max_amount(self, obj):
-        return obj.proxypay_fee_data.get('applied_max_amount') or _('Not Applied')
+        return self.get_json_value(obj, 'proxypay_fee_max_amount') or _('Not Applied')
 
     # --------------------------------------------------------------------------------------------
     ###
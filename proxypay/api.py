@@ -1,4 +1,11 @@
-import requests
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+from . import breaker, deadlines, metrics, ratelimit, retries, transports
 from .configs import conf as configuration
 
 # ==========================================================================================================
@@ -7,23 +14,29 @@ from .configs import conf as configuration
 
 class ProxypayAPI:
 
-    __headers  = {}     # default api headers
-    __url      = ''     # base api url
-    __entity   = None   # 
-    env        = None
+    __headers   = {}     # default api headers
+    __url       = ''     # base api url
+    __entity    = None   # 
+    __transport = None   # http backend, see proxypay.transports, created on first request
+    __hedging   = None   # threads of the hedged requests
+    env         = None
 
-    def __init__(self, config=None):
+    def __init__(self, config=None, transport=None):
 
         conf = config or configuration
+        self.__conf = conf
+        self.__lock = threading.Lock()
         # setting the headers
         self.__headers = {
             'Content-Type': 'application/json',
             'Accept': 'application/vnd.proxypay.v2+json',
             'Authorization': f"Token {conf.get_token()}"
         }
-        self.__url    = conf.get_url()
-        self.__entity = conf.get_entity()
-        self.env      = conf.get_environment()
+        self.__url       = conf.get_url()
+        self.__entity    = conf.get_entity()
+        self.__transport = transport
+        self.env         = conf.get_environment()
+        self.timeout     = conf.get_timeout()
 
     # ==========================================================
 
@@ -35,6 +48,35 @@ class ProxypayAPI:
     def entity(self):
         return self.__entity
 
+    @property
+    def transport(self):
+        """
+        Transport shared by all threads, pooled so requests to Proxypay
+        reuse established TCP/TLS connections. See PROXYPAY['TRANSPORT']
+        """
+        if self.__transport is None:
+            with self.__lock:
+                if self.__transport is None:
+                    self.__transport = transports.build_transport(self.__conf, self.__url, self.__headers)
+        return self.__transport
+
+    def warm_up(self):
+        """
+        Opens a connection to Proxypay ahead of the first real request.
+        Errors are ignored, the connection will be made on demand
+        """
+        return self.transport.warm_up()
+
+    def close(self):
+        """Closes the transport and all its connections"""
+        with self.__lock:
+            if self.__transport is not None:
+                self.__transport.close()
+                self.__transport = None
+            if self.__hedging is not None:
+                self.__hedging.shutdown(wait=False)
+                self.__hedging = None
+
     # ==========================================================
     
     ###
@@ -88,14 +130,14 @@ class ProxypayAPI:
 
     # get unrecognized payments
 
-    def get_payments(self):
+    def get_payments(self, hedge_after=None):
         
         """
         Returns a list of all payments that have 
-        not yet been recognized
+        not yet been recognized. The request is hedged, see hedged_get
         """
 
-        r = self.get('/payments')
+        r = self.hedged_get('/payments', hedge_after=hedge_after)
         # response status
         return r.json() if r.status_code == 200 else False
 
@@ -135,28 +177,341 @@ class ProxypayAPI:
     ##  Base Request Methods, GET, POST, PUT, DELETE
     #   
 
-    def get(self, path, params={}):
-        """ makes a GET request, path parameter must init with / """
-        with requests.get(f"{self.__url}{path}", params=params, headers=self.__headers,) as r:
+    def request(self, method, path, json=None, params=None, timeout=None):
+        """
+        makes a request with the transport, measured by proxypay.metrics.
+        Idempotent requests are retried, see proxypay.retries, and refused while
+        the circuit breaker is open, see proxypay.breaker. The timeout and retries
+        are limited by the current deadline, see proxypay.deadlines
+        """
+        circuit  = breaker.get_breaker()
+        attempts = retries.get_attempts(method)
+        deadlines.check()
+        # the breaker counts requests, their outcome is recorded after the last attempt
+        trial    = circuit.before_call()
+        for attempt in range(attempts):
+            deadlines.check()
+            ratelimit.acquire(path)
+            try:
+                with metrics.track_request(method, path) as track:
+                    r = self.transport.request(
+                        method, path, json=json, params=params, timeout=deadlines.get_timeout(timeout or self.timeout)
+                    )
+                    track(r.status_code)
+            except self.transport.errors:
+                # timeout cut by the deadline, not a Proxypay failure
+                deadlines.check()
+                # last attempt, or no time left to retry
+                if attempt + 1 >= attempts or not deadlines.fits(backoff := retries.get_backoff(attempt)):
+                    circuit.record_failure(trial)
+                    raise
+            else:
+                if (
+                    attempt + 1 >= attempts or not retries.should_retry(r)
+                    or not deadlines.fits(backoff := retries.get_backoff(attempt, r))
+                ):
+                    if r.status_code >= 500:
+                        circuit.record_failure(trial)
+                    else:
+                        circuit.record_success(trial)
+                    return r
+            metrics.retried(method, path)
+            time.sleep(backoff)
+
+    def hedged_get(self, path, params={}, hedge_after=None, timeout=None):
+        """
+        makes a GET request, hedged after <hedge_after> seconds (PROXYPAY['API_HEDGE_AFTER'] by default):
+        without a response by then, a duplicate request is sent and the first response is used.
+        Only for idempotent reads, the slow request is not cancelled
+        """
+        hedge_after = self.__conf.API_HEDGE_AFTER if hedge_after is None else hedge_after
+        if not hedge_after or not deadlines.fits(hedge_after):
+            return self.get(path, params, timeout)
+
+        if self.__hedging is None:
+            with self.__lock:
+                if self.__hedging is None:
+                    self.__hedging = ThreadPoolExecutor(self.__conf.API_POOL_SIZE, thread_name_prefix='proxypay-hedge')
+        # the requests run in the context of the caller, with its deadline
+        submit  = lambda: self.__hedging.submit(contextvars.copy_context().run, self.get, path, params, timeout)
+        first   = submit()
+        futures = [first]
+        if not wait(futures, timeout=hedge_after).done:
+            metrics.increment('proxypay_api_hedged_total', {'endpoint': metrics.normalize_path(path), 'result': 'sent'})
+            futures.append(submit())
+
+        error = None
+        for future in as_completed(futures):
+            try:
+                r = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if future is not first:
+                metrics.increment('proxypay_api_hedged_total', {'endpoint': metrics.normalize_path(path), 'result': 'won'})
             return r
+        raise error
+
+    def get(self, path, params={}, timeout=None):
+        """ makes a GET request, path parameter must init with / """
+        return self.request('GET', path, params=params, timeout=timeout)
 
-    def post(self, path, data={}, params={}):
+    def post(self, path, data={}, params={}, timeout=None):
         """ makes a POST request, path parameter must init with / """
-        with requests.post(f"{self.__url}{path}", json=data, params=params, headers=self.__headers,) as r:
-            return r
+        return self.request('POST', path, json=data, params=params, timeout=timeout)
 
-    def put(self, path, data={}, params={}):
+    def put(self, path, data={}, params={}, timeout=None):
         """ makes a PUT request, path parameter must init with / """
-        with requests.put(f"{self.__url}{path}", json=data, params=params, headers=self.__headers,) as r:
-            return r
+        return self.request('PUT', path, json=data, params=params, timeout=timeout)
 
-    def delete(self, path, data={}, params={}):
+    def delete(self, path, data={}, params={}, timeout=None):
         """ makes a DELETE request, path parameter must init with / """
-        with requests.delete(f"{self.__url}{path}", json=data, params=params, headers=self.__headers,) as r:
-            return r
+        return self.request('DELETE', path, json=data, params=params, timeout=timeout)
     
     # ==========================================================
     
 # ==========================================================================================================
 
-api = ProxypayAPI()
\ No newline at end of file
+"""Asyncio version of ProxypayAPI, for ASGI deployments. Requires httpx"""
+
+class AsyncProxypayAPI:
+
+    __headers   = {}     # default api headers
+    __url       = ''     # base api url
+    __entity    = None   # 
+    __transport = None   # async http backend, see proxypay.transports
+    env         = None
+
+    def __init__(self, config=None, transport=None):
+
+        conf = config or configuration
+        self.__conf = conf
+        self.__lock = threading.Lock()
+        # setting the headers
+        self.__headers = {
+            'Content-Type': 'application/json',
+            'Accept': 'application/vnd.proxypay.v2+json',
+            'Authorization': f"Token {conf.get_token()}"
+        }
+        self.__url       = conf.get_url()
+        self.__entity    = conf.get_entity()
+        self.__transport = transport
+        self.env         = conf.get_environment()
+        self.timeout     = conf.get_timeout()
+
+    # ==========================================================
+
+    ###
+    ##  Property Methods
+    # 
+
+    @property
+    def entity(self):
+        return self.__entity
+
+    @property
+    def transport(self):
+        """Async transport, AsyncHttpxTransport keeps one pooled client per event loop"""
+        if self.__transport is None:
+            with self.__lock:
+                if self.__transport is None:
+                    self.__transport = transports.build_transport(
+                        self.__conf, self.__url, self.__headers, asynchronous=True
+                    )
+        return self.__transport
+
+    async def warm_up(self):
+        return await self.transport.warm_up()
+
+    async def close(self):
+        """Closes the transport connections of the running event loop"""
+        await self.transport.close()
+
+    # ==========================================================
+    
+    ###
+    ##  Interaction With Proxypay
+    # 
+
+    # ------------------------ REFERENCES -----------------------
+
+    async def get_reference_id(self):
+        """
+        Get Generated Reference Id from Proxypay
+        Returns reference id (int as string) or False 
+        """
+        r = await self.post('/reference_ids')
+        return r.json() if r.status_code == 200 else False
+
+    async def create_or_update_reference(self, reference_id, data):
+        """
+        Creates or Update a Pament Reference by Reference Id
+        data = { amount, end_datetime, custom_fields }
+        """
+        r = await self.put(f"/references/{reference_id}", data=data)
+        return True if r.status_code == 204 else False
+
+    async def delete_reference(self, reference_id):
+        """
+        Delete a reference from Proxypay
+        """
+        r = await self.delete(f"/references/{reference_id}")
+        return True if r.status_code == 204 else False
+
+    # ------------------------ PAYMENTS -----------------------
+
+    async def get_payments(self, hedge_after=None):
+        """
+        Returns a list of all payments that have 
+        not yet been recognized. The request is hedged, see hedged_get
+        """
+        r = await self.hedged_get('/payments', hedge_after=hedge_after)
+        return r.json() if r.status_code == 200 else False
+
+    async def check_reference_payment(self, reference_id):
+        """
+        Checks if a reference has already been paid, if so, 
+        returns the payment data and eliminates the payment data in proxyapy
+        """
+        payments = await self.get_payments()
+
+        if payments:
+            for payment in payments:
+                if payment.get('reference_id') == reference_id:
+                    await self.acknowledge_payment(payment.get('id'))
+                    return payment
+        
+        return False
+
+    async def acknowledge_payment(self, payment_id):
+        r = await self.delete(f"/payments/{payment_id}")
+        return True if r.status_code == 204 else False
+
+    # ==========================================================
+
+    ###
+    ##  Base Request Methods, GET, POST, PUT, DELETE
+    #   
+
+    async def request(self, method, path, json=None, params=None, timeout=None):
+        """ async version of ProxypayAPI.request """
+        circuit  = breaker.get_breaker()
+        attempts = retries.get_attempts(method)
+        deadlines.check()
+        # the breaker counts requests, their outcome is recorded after the last attempt
+        trial    = await circuit.abefore_call()
+        for attempt in range(attempts):
+            deadlines.check()
+            await ratelimit.aacquire(path)
+            try:
+                with metrics.track_request(method, path) as track:
+                    r = await self.transport.request(
+                        method, path, json=json, params=params, timeout=deadlines.get_timeout(timeout or self.timeout)
+                    )
+                    track(r.status_code)
+            except self.transport.errors:
+                # timeout cut by the deadline, not a Proxypay failure
+                deadlines.check()
+                # last attempt, or no time left to retry
+                if attempt + 1 >= attempts or not deadlines.fits(backoff := retries.get_backoff(attempt)):
+                    await circuit.arecord_failure(trial)
+                    raise
+            else:
+                if (
+                    attempt + 1 >= attempts or not retries.should_retry(r)
+                    or not deadlines.fits(backoff := retries.get_backoff(attempt, r))
+                ):
+                    if r.status_code >= 500:
+                        await circuit.arecord_failure(trial)
+                    else:
+                        await circuit.arecord_success(trial)
+                    return r
+            metrics.retried(method, path)
+            await asyncio.sleep(backoff)
+
+    async def hedged_get(self, path, params={}, hedge_after=None, timeout=None):
+        """ async version of ProxypayAPI.hedged_get, the slow request is cancelled """
+        hedge_after = self.__conf.API_HEDGE_AFTER if hedge_after is None else hedge_after
+        if not hedge_after or not deadlines.fits(hedge_after):
+            return await self.get(path, params, timeout)
+
+        first   = asyncio.ensure_future(self.get(path, params, timeout))
+        pending = {first}
+        done, _ = await asyncio.wait(pending, timeout=hedge_after)
+        if not done:
+            metrics.increment('proxypay_api_hedged_total', {'endpoint': metrics.normalize_path(path), 'result': 'sent'})
+            pending.add(asyncio.ensure_future(self.get(path, params, timeout)))
+
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if (error := task.exception()) is None:
+                        if task is not first:
+                            metrics.increment(
+                                'proxypay_api_hedged_total', {'endpoint': metrics.normalize_path(path), 'result': 'won'}
+                            )
+                        return task.result()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def get(self, path, params={}, timeout=None):
+        """ makes a GET request, path parameter must init with / """
+        return await self.request('GET', path, params=params, timeout=timeout)
+
+    async def post(self, path, data={}, params={}, timeout=None):
+        """ makes a POST request, path parameter must init with / """
+        return await self.request('POST', path, json=data, params=params, timeout=timeout)
+
+    async def put(self, path, data={}, params={}, timeout=None):
+        """ makes a PUT request, path parameter must init with / """
+        return await self.request('PUT', path, json=data, params=params, timeout=timeout)
+
+    async def delete(self, path, data={}, params={}, timeout=None):
+        """ makes a DELETE request, path parameter must init with / """
+        return await self.request('DELETE', path, json=data, params=params, timeout=timeout)
+
+    # ==========================================================
+
+# ==========================================================================================================
+
+class LazyAPI:
+
+    """
+    Proxy that builds the api client on first use, instead of at import time,
+    so importing proxypay doesn't read the settings or load the http libraries.
+    One client per process, a forked process builds its own (connections can't be shared)
+    """
+
+    def __init__(self, factory):
+        self.__factory  = factory
+        self.__lock     = threading.Lock()
+        self.__instance = None
+        self.__pid      = None
+
+    @property
+    def instance(self):
+        pid = os.getpid()
+        if self.__instance is None or self.__pid != pid:
+            with self.__lock:
+                if self.__instance is None or self.__pid != pid:
+                    self.__instance = self.__factory()
+                    self.__pid      = pid
+        return self.__instance
+
+    def __getattr__(self, attr):
+        if '_LazyAPI__factory' not in self.__dict__:
+            # not initialized yet (copy, pickle)
+            raise AttributeError(attr)
+        return getattr(self.instance, attr)
+
+    def __repr__(self):
+        return f"<LazyAPI: {self.__factory.__name__}>"
+
+# ==========================================================================================================
+
+api = LazyAPI(ProxypayAPI)
+async_api = LazyAPI(AsyncProxypayAPI)
\ No newline at end of file
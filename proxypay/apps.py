@@ -5,4 +5,8 @@ class ProxypayConfig(AppConfig):
     name = 'proxypay'
 
     def ready(self):
-        from . import signals
\ No newline at end of file
+        from . import signals
+        from .configs import conf
+        if conf.API_WARM_UP:
+            from .api import api
+            api.warm_up()
\ No newline at end of file
@@ -0,0 +1,198 @@
+###
+##  Django Proxypay Circuit Breaker
+#
+#   When CIRCUIT_BREAKER_THRESHOLD calls to Proxypay fail within CIRCUIT_BREAKER_WINDOW seconds
+#   (connection errors, timeouts, 5xx, after the retries of the call), the breaker opens for
+#   CIRCUIT_BREAKER_RESET_TIMEOUT seconds: calls raise ProxypayCircuitOpen right away instead of
+#   waiting for a degraded Proxypay. Then a single trial call is let through (half open), closing
+#   the breaker if it succeeds. before_call returns whether the call is the trial, to pass to
+#   record_success or record_failure: the trial is a call, not a state of the process.
+#   The state is shared by all processes through Django's cache, and kept by each process until
+#   the breaker's reopening time, so calls fail fast without any cache round trip while open
+
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+
+from . import metrics
+from .configs import conf
+from .exceptions import ProxypayCircuitOpen
+
+# ==========================================================================================================
+
+PREFIX = 'proxypay:breaker'
+
+# seconds a process trusts its view of a closed breaker before reading the shared state again
+CHECK_INTERVAL = 1
+
+class CircuitBreaker:
+
+    def __init__(self, name='api', threshold=5, window=30, reset_timeout=30, cache_alias='default'):
+        self.name          = name
+        self.threshold     = threshold
+        self.window        = window
+        self.reset_timeout = reset_timeout
+        self.cache_alias   = cache_alias
+        self.lock          = threading.Lock()
+        # process local state
+        self.open_until    = 0
+        self.checked_at    = 0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def key(self, name):
+        return f"{PREFIX}:{self.name}:{name}"
+
+    def fail_fast(self):
+        metrics.increment('proxypay_circuit_refused_total')
+        raise ProxypayCircuitOpen(
+            _('Proxypay circuit breaker is open, calls are refused for %.1fs') % max(self.open_until - time.time(), 0)
+        )
+
+    def is_known_closed(self):
+        """Closed for this process, without reading the shared state. Raises ProxypayCircuitOpen if open"""
+        current = time.time()
+        if current < self.open_until:
+            self.fail_fast()
+        return current - self.checked_at < CHECK_INTERVAL
+
+    def before_call(self):
+        """
+        Raises ProxypayCircuitOpen if the breaker is open.
+        Returns True if the call is the trial call of the half open breaker
+        """
+
+        if self.is_known_closed():
+            return False
+
+        current = time.time()
+        try:
+            open_until = self.cache.get(self.key('open_until')) or 0
+        except Exception:
+            # without the shared state, the breaker is closed
+            return False
+        with self.lock:
+            self.checked_at = current
+            self.open_until = open_until
+        if current < open_until:
+            self.fail_fast()
+        if open_until:
+            # reset timeout elapsed, half open: one trial call, the other ones fail fast
+            try:
+                trial = self.cache.add(self.key('trial'), 1, self.reset_timeout)
+            except Exception:
+                return False
+            # the other calls of this process fail fast too while the trial call runs
+            with self.lock:
+                self.open_until = current + CHECK_INTERVAL
+            if not trial:
+                self.fail_fast()
+            return True
+        return False
+
+    def record_success(self, trial=False):
+        if trial:
+            # trial call succeeded, closing the breaker
+            with self.lock:
+                self.open_until = 0
+            try:
+                self.cache.delete_many([self.key('open_until'), self.key('trial'), self.key('failures')])
+            except Exception:
+                pass
+
+    def record_failure(self, trial=False):
+        try:
+            cache = self.cache
+            if trial:
+                failures = self.threshold
+            else:
+                cache.add(self.key('failures'), 0, self.window)
+                failures = cache.incr(self.key('failures'))
+            if failures >= self.threshold:
+                self.open()
+        except Exception:
+            # failures key expired between add and incr, or cache errors
+            pass
+
+    def open(self):
+        metrics.increment('proxypay_circuit_opened_total')
+        open_until = time.time() + self.reset_timeout
+        self.cache.set(self.key('open_until'), open_until, self.reset_timeout * 2)
+        self.cache.delete_many([self.key('trial'), self.key('failures')])
+        with self.lock:
+            self.open_until = open_until
+
+    def reset(self):
+        self.cache.delete_many([self.key('open_until'), self.key('trial'), self.key('failures')])
+        with self.lock:
+            self.open_until, self.checked_at = 0, 0
+
+    # async versions, the cache calls run in a thread
+
+    async def abefore_call(self):
+        if self.is_known_closed():
+            return False
+        return await sync_to_async(self.before_call)()
+
+    async def arecord_success(self, trial=False):
+        if trial:
+            await sync_to_async(self.record_success)(trial)
+
+    async def arecord_failure(self, trial=False):
+        await sync_to_async(self.record_failure)(trial)
+
+class NullBreaker:
+
+    """Breaker of the disabled circuit breaker, always closed"""
+
+    def before_call(self):
+        return False
+
+    def record_success(self, trial=False):
+        pass
+
+    def record_failure(self, trial=False):
+        pass
+
+    def reset(self):
+        pass
+
+    async def abefore_call(self):
+        return False
+
+    async def arecord_success(self, trial=False):
+        pass
+
+    async def arecord_failure(self, trial=False):
+        pass
+
+# ==========================================================================================================
+
+_breaker      = (None, None)
+_breaker_lock = threading.Lock()
+
+def get_breaker():
+    """Returns the circuit breaker of this process for the current settings"""
+    global _breaker
+    key = (
+        conf.CIRCUIT_BREAKER, conf.CIRCUIT_BREAKER_THRESHOLD, conf.CIRCUIT_BREAKER_WINDOW,
+        conf.CIRCUIT_BREAKER_RESET_TIMEOUT, conf.CIRCUIT_BREAKER_CACHE_ALIAS
+    )
+    cached_key, breaker = _breaker
+    if breaker is None or cached_key != key:
+        with _breaker_lock:
+            cached_key, breaker = _breaker
+            if breaker is None or cached_key != key:
+                breaker = CircuitBreaker(
+                    threshold=conf.CIRCUIT_BREAKER_THRESHOLD,
+                    window=conf.CIRCUIT_BREAKER_WINDOW,
+                    reset_timeout=conf.CIRCUIT_BREAKER_RESET_TIMEOUT,
+                    cache_alias=conf.CIRCUIT_BREAKER_CACHE_ALIAS
+                ) if conf.CIRCUIT_BREAKER else NullBreaker()
+                _breaker = (key, breaker)
+    return breaker
@@ -1,4 +1,5 @@
 from django.conf import settings
+from django.core.signals import setting_changed
 from django.utils.translation import gettext_lazy as _
 
 from proxypay.exceptions import ProxypayValueError
@@ -12,8 +13,30 @@ DEFAULTS = {
     # references
     'REFERENCE_LIFE_TIME_IN_DAYS': 1,
     'REFERENCE_UUID_KEY': 'djpp_uuid_ref',
+    # If true, reference ids are reserved from proxypay ahead of time and kept in the database.
+    # The pool is refilled up to the high watermark when it falls below the low watermark
+    'REFERENCE_ID_POOL': False,
+    'REFERENCE_ID_POOL_LOW_WATERMARK': 20,
+    'REFERENCE_ID_POOL_HIGH_WATERMARK': 100,
+    # cache of the refill lock, shared by all processes
+    'REFERENCE_ID_POOL_CACHE_ALIAS': 'default',
+    # If true, proxypay.references.get lookups are cached with Django's cache framework,
+    # in the REFERENCE_CACHE_ALIAS cache, for REFERENCE_CACHE_TIMEOUT seconds.
+    # Misses are cached for REFERENCE_CACHE_NEGATIVE_TIMEOUT seconds
+    'REFERENCE_CACHE': False,
+    'REFERENCE_CACHE_ALIAS': 'default',
+    'REFERENCE_CACHE_TIMEOUT': 300,
+    'REFERENCE_CACHE_NEGATIVE_TIMEOUT': 5,
     # payments
     'ACCEPT_UNRECOGNIZED_PAYMENT': False,
+    # If true, the webhook view only checks the signature and stores the payment,
+    # payments are applied by the worker: python manage.py proxypay inbox
+    'WEBHOOK_INBOX': False,
+    # attempts before giving up on an inbox payment that fails
+    'WEBHOOK_INBOX_MAX_ATTEMPTS': 5,
+    # seconds before retrying an inbox payment that fails, doubled after each attempt up to the max
+    'WEBHOOK_INBOX_RETRY_BACKOFF': 5,
+    'WEBHOOK_INBOX_RETRY_MAX_BACKOFF': 600,
     # If true, in sandbox env mode fictitious payments will be processed automatically without the proxypay webhook.
     # Useful if you want to test local payments without configuring the endpoint watch payments on proxypay
     'ACKNOWLEDGE_MOCK_PAYMENT_LOCALLY_AUTOMATICALLY': True,
@@ -25,6 +48,56 @@ DEFAULTS = {
     'API_PRODUCTION_BASE_URL': 'https://api.proxypay.co.ao',
     'API_SANDBOX_BASE_URL': 'https://api.sandbox.proxypay.co.ao',
     'ENV': None, # production or sandbox
+    # http connections
+    # number of keep-alive connections kept open to Proxypay
+    'API_POOL_SIZE': 10,
+    # timeouts in seconds, connect and read
+    'API_CONNECT_TIMEOUT': 5,
+    'API_READ_TIMEOUT': 30,
+    # If true, a connection to Proxypay is opened when the app is ready
+    'API_WARM_UP': False,
+    # http backend: requests, urllib3, httpx, fake (in memory Proxypay) or the dotted path of a
+    # proxypay.transports.Transport subclass. ASYNC_TRANSPORT: httpx or fake, None to follow TRANSPORT
+    'TRANSPORT': 'requests',
+    'ASYNC_TRANSPORT': None,
+    # If true, the httpx transports use HTTP/2, requires httpx[http2]
+    'API_HTTP2': False,
+    # retries of the idempotent calls (GET, PUT, DELETE) on errors, 5xx and 429 responses,
+    # with exponential backoff and full jitter, see proxypay.retries. Backoffs in seconds
+    'API_RETRIES': 2,
+    'API_RETRY_BACKOFF': 0.1,
+    'API_RETRY_MAX_BACKOFF': 2,
+    # seconds after which a duplicate GET /payments is sent if Proxypay hasn't answered, None to disable
+    'API_HEDGE_AFTER': None,
+    # If true, calls fail fast with ProxypayCircuitOpen for CIRCUIT_BREAKER_RESET_TIMEOUT seconds after
+    # CIRCUIT_BREAKER_THRESHOLD failed calls (after their retries) within CIRCUIT_BREAKER_WINDOW seconds, see proxypay.breaker
+    'CIRCUIT_BREAKER': False,
+    'CIRCUIT_BREAKER_THRESHOLD': 5,
+    'CIRCUIT_BREAKER_WINDOW': 30,
+    'CIRCUIT_BREAKER_RESET_TIMEOUT': 30,
+    'CIRCUIT_BREAKER_CACHE_ALIAS': 'default',
+    # client side rate limit shared by all processes through the cache, see proxypay.ratelimit
+    # by endpoint class, (requests per second, burst): {'reference_ids': (10, 20), 'references': ..., 'payments': ...}
+    'RATE_LIMIT': None,
+    # wait: calls over the limit wait their turn up to RATE_LIMIT_MAX_WAIT seconds, fail: raise ProxypayRateLimited
+    'RATE_LIMIT_POLICY': 'wait',
+    'RATE_LIMIT_MAX_WAIT': 5,
+    'RATE_LIMIT_CACHE_ALIAS': 'default',
+    # metrics
+    # backend keeping the api and webhook metrics, see proxypay.metrics. None to disable
+    'METRICS_BACKEND': 'proxypay.metrics.InMemoryBackend',
+    # If set, the metrics view requires the header: Authorization: Bearer <METRICS_TOKEN>
+    'METRICS_TOKEN': None,
+    # signals receivers: sync (in the request), on_commit (after the transaction commits),
+    # thread (after the commit, on a pool of SIGNAL_DISPATCH_WORKERS threads)
+    'SIGNAL_DISPATCH': 'sync',
+    'SIGNAL_DISPATCH_WORKERS': 4,
+    # dispatches waiting for a thread, beyond that they run in the calling thread
+    'SIGNAL_DISPATCH_QUEUE_SIZE': 1000,
+    # admin
+    # If true, the references changelist uses estimated counts, keyset pagination and
+    # loads only the listed columns, for tables with millions of references
+    'ADMIN_LARGE_TABLE_MODE': False,
 }
 
 # ================================================================================
@@ -65,12 +138,10 @@ class AppConfigurations:
         setattr(self, attr, value)
         return value
     
-    # def reload(self):
-    #     for attr in self._cached_attrs:
-    #         delattr(self, attr)
-    #     self._cached_attrs.clear()
-    #     if hasattr(self, '_user_configurations'):
-    #         delattr(self, '_user_configurations')
+    def reload(self):
+        for attr in self._cached_attrs:
+            delattr(self, attr)
+        self._cached_attrs.clear()
     
     ### ------------------------------------------------------------------------
 
@@ -89,6 +160,9 @@ class AppConfigurations:
 
     def get_token(self):
         return self.PRIVATE_KEY
+
+    def get_timeout(self):
+        return (self.API_CONNECT_TIMEOUT, self.API_READ_TIMEOUT)
     
     def get_reference_lifetime(self, days=None):
         try:
@@ -96,4 +170,10 @@ class AppConfigurations:
         except:
             raise ProxypayValueError(_('days must be a number'))
     
-conf = AppConfigurations()
\ No newline at end of file
+conf = AppConfigurations()
+
+def reload_configurations(setting, **kwargs):
+    if setting == 'PROXYPAY':
+        conf.reload()
+
+setting_changed.connect(reload_configurations)
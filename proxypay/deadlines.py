@@ -0,0 +1,61 @@
+###
+##  Django Proxypay Deadlines
+#
+#   Latency budget of the Proxypay calls, kept in a context variable so it's shared by all
+#   the calls made inside, like references.create (reference id, reference) or check_payment:
+#
+#       with deadline(2.5):
+#           reference = references.create(3500)
+#
+#   Calls made after the deadline raise ProxypayDeadlineExceeded, request timeouts are cut to the
+#   time left and retries or rate limit waits that wouldn't fit in it are not made.
+#   Nested deadlines can only shorten the current one
+
+import contextvars
+import time
+from contextlib import contextmanager
+
+from django.utils.translation import gettext_lazy as _
+
+from .exceptions import ProxypayDeadlineExceeded
+
+# ==========================================================================================================
+
+# time.monotonic() at which the current deadline expires, None without deadline
+_deadline = contextvars.ContextVar('proxypay_deadline', default=None)
+
+@contextmanager
+def deadline(seconds):
+    """Sets a deadline of <seconds> from now for the calls made inside. None doesn't change the current one"""
+    if seconds is None:
+        yield
+        return
+    expires = time.monotonic() + seconds
+    current = _deadline.get()
+    token   = _deadline.set(expires if current is None else min(current, expires))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining():
+    """Seconds left before the deadline, None without deadline"""
+    if (expires := _deadline.get()) is None:
+        return None
+    return expires - time.monotonic()
+
+def check():
+    """Raises ProxypayDeadlineExceeded if the deadline is over"""
+    if (left := remaining()) is not None and left <= 0:
+        raise ProxypayDeadlineExceeded(_('Proxypay call deadline exceeded by %.3fs') % -left)
+
+def get_timeout(timeout):
+    """(connect, read) timeout of a request, cut to the time left before the deadline"""
+    if (left := remaining()) is None:
+        return timeout
+    connect_timeout, read_timeout = timeout if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+    return (min(connect_timeout, left), min(read_timeout, left))
+
+def fits(seconds):
+    """True if waiting <seconds> leaves time before the deadline"""
+    return (left := remaining()) is None or seconds < left
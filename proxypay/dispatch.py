@@ -0,0 +1,194 @@
+###
+##  Django Proxypay Signal Dispatch
+#
+#   How reference_paid, reference_created and references_created receivers are run,
+#   set with PROXYPAY['SIGNAL_DISPATCH']:
+#   'sync'       right away, in the webhook or checkout request (default, like Signal.send)
+#   'on_commit'  after the current transaction commits (right away without transaction)
+#   'thread'     after the commit, on a pool of SIGNAL_DISPATCH_WORKERS threads, so the request
+#                doesn't wait for the receivers. Up to SIGNAL_DISPATCH_QUEUE_SIZE dispatches wait
+#                for a thread, beyond that they run in the calling thread
+#   The time taken by each receiver is recorded in proxypay.metrics (by all the receivers at once, if
+#   Django's signals can't list them). In the deferred modes, receiver errors are logged
+#   (logger 'proxypay.dispatch') and don't stop the other receivers
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from asgiref.sync import async_to_sync
+from django.db import close_old_connections, transaction
+
+from . import metrics
+from .configs import conf
+
+# ==========================================================================================================
+
+SYNC      = 'sync'
+ON_COMMIT = 'on_commit'
+THREAD    = 'thread'
+
+logger = logging.getLogger('proxypay.dispatch')
+
+# receiver label of the signals timed as a whole, see get_receivers
+ALL_RECEIVERS = '*'
+
+def get_receivers(signal, sender):
+    """
+    Receivers of the signal for sender, to call and time them one by one, from the private
+    Signal._live_receivers: a list before Django 5, a (sync, async) tuple since.
+    None if it's not available or has changed, the signal is then sent with Signal.send
+    """
+    try:
+        receivers = signal._live_receivers(sender)
+    except (AttributeError, TypeError):
+        return None
+    if isinstance(receivers, tuple) and len(receivers) == 2:
+        sync_receivers, async_receivers = receivers
+        receivers = [*sync_receivers, *(async_to_sync(receiver) for receiver in async_receivers)]
+    if not isinstance(receivers, list) or not all(callable(receiver) for receiver in receivers):
+        return None
+    return receivers
+
+def get_name(obj):
+    return f"{getattr(obj, '__module__', '')}.{getattr(obj, '__qualname__', repr(obj))}"
+
+def get_signal_name(signal):
+    from . import signals
+
+    for name, value in vars(signals).items():
+        if value is signal:
+            return name
+    return get_name(signal)
+
+# ==========================================================================================================
+
+def run(signal, sender, batch, robust=False):
+    """
+    Calls the receivers of the signal once for every kwargs dict of the batch, timing each receiver.
+    With robust, receiver errors are logged instead of raised
+    """
+
+    if not signal.receivers:
+        return
+    signal_name = get_signal_name(signal)
+    receivers   = get_receivers(signal, sender)
+    if receivers is None:
+        return send_all(signal, sender, batch, robust, signal_name)
+    for receiver in receivers:
+        labels  = {'signal': signal_name, 'receiver': get_name(receiver)}
+        started = time.perf_counter()
+        try:
+            for kwargs in batch:
+                try:
+                    receiver(signal=signal, sender=sender, **kwargs)
+                except Exception:
+                    metrics.increment('proxypay_signal_receiver_errors_total', labels)
+                    if not robust:
+                        raise
+                    logger.exception('Error in %s receiver %s', signal_name, labels['receiver'])
+        finally:
+            metrics.observe('proxypay_signal_receiver_duration_seconds', time.perf_counter() - started, labels)
+
+def send_all(signal, sender, batch, robust, signal_name):
+    """Sends the signal with Signal.send (send_robust if robust), timing all its receivers at once"""
+
+    labels = {'signal': signal_name, 'receiver': ALL_RECEIVERS}
+    for kwargs in batch:
+        started = time.perf_counter()
+        try:
+            if not robust:
+                signal.send(sender, **kwargs)
+                continue
+            for receiver, response in signal.send_robust(sender, **kwargs):
+                if isinstance(response, Exception):
+                    metrics.increment('proxypay_signal_receiver_errors_total', {**labels, 'receiver': get_name(receiver)})
+                    logger.error(
+                        'Error in %s receiver %s', signal_name, get_name(receiver),
+                        exc_info=(type(response), response, response.__traceback__)
+                    )
+        except Exception:
+            metrics.increment('proxypay_signal_receiver_errors_total', labels)
+            raise
+        finally:
+            metrics.observe('proxypay_signal_receiver_duration_seconds', time.perf_counter() - started, labels)
+
+# ==========================================================================================================
+
+class Dispatcher:
+
+    """Bounded thread pool running the receivers in thread mode"""
+
+    def __init__(self, workers, queue_size):
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='proxypay-dispatch')
+        self.slots    = threading.BoundedSemaphore(workers + queue_size)
+        self.lock     = threading.Lock()
+        self.pending  = set()
+
+    def submit(self, signal, sender, batch):
+        if not self.slots.acquire(blocking=False):
+            # pool and queue full, the caller runs the receivers (back pressure)
+            metrics.increment('proxypay_signal_dispatch_inline_total', {'signal': get_signal_name(signal)})
+            return run(signal, sender, batch, robust=True)
+        future = self.executor.submit(self.work, signal, sender, batch)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+
+    def work(self, signal, sender, batch):
+        # receivers may use the database, connections of the thread are closed like after a request
+        close_old_connections()
+        try:
+            run(signal, sender, batch, robust=True)
+        finally:
+            close_old_connections()
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+
+    def flush(self, timeout=None):
+        """Waits for the submitted dispatches, returns True if all are done"""
+        with self.lock:
+            pending = list(self.pending)
+        return not wait(pending, timeout=timeout).not_done
+
+_dispatcher      = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = Dispatcher(conf.SIGNAL_DISPATCH_WORKERS, conf.SIGNAL_DISPATCH_QUEUE_SIZE)
+    return _dispatcher
+
+def flush(timeout=None):
+    """Waits for the receivers running in thread mode, for tests and management commands"""
+    return _dispatcher.flush(timeout) if _dispatcher is not None else True
+
+# ==========================================================================================================
+
+def send_many(signal, sender, batch, using=None):
+    """
+    Sends the signal once for every kwargs dict of batch, with the SIGNAL_DISPATCH mode.
+    In the deferred modes, the whole batch is a single commit callback and a single pool job
+    """
+
+    batch = list(batch)
+    if not batch or not signal.receivers:
+        return
+    mode = conf.SIGNAL_DISPATCH
+    if mode == SYNC:
+        return run(signal, sender, batch)
+    if mode == THREAD:
+        transaction.on_commit(lambda: get_dispatcher().submit(signal, sender, batch), using=using)
+    else:
+        transaction.on_commit(lambda: run(signal, sender, batch, robust=True), using=using)
+
+def send(signal, sender, using=None, **kwargs):
+    """Sends the signal with the SIGNAL_DISPATCH mode, see send_many"""
+    send_many(signal, sender, [kwargs], using=using)
@@ -2,4 +2,10 @@ class ProxypayException(Exception): pass
 
 class ProxypayKeyError(KeyError): pass
 
-class ProxypayValueError(Exception): pass
\ No newline at end of file
+class ProxypayValueError(Exception): pass
+
+class ProxypayRateLimited(ProxypayException): pass
+
+class ProxypayCircuitOpen(ProxypayException): pass
+
+class ProxypayDeadlineExceeded(ProxypayException): pass
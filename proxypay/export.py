@@ -0,0 +1,73 @@
+###
+##  Django Proxypay References Export
+#
+#   Streams references as CSV or JSON Lines, reading the table in chunks
+#   with QuerySet.iterator, so memory stays flat whatever the number of references
+
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import JSON_KEYS
+
+# ==============================================================================================
+
+EXPORT_FIELDS = (
+    'key',
+    'reference',
+    'entity',
+    'amount',
+    'net_amount',
+    'fees_expense',
+    'proxypay_fee',
+    'bank_fee',
+    'status',
+    'created_at',
+    'updated_at',
+    'expires_in',
+    'paid_at',
+)
+EXPORT_COLUMNS = EXPORT_FIELDS + tuple(JSON_KEYS)
+FORMATS = ('csv', 'jsonl')
+
+# ==============================================================================================
+
+def iter_rows(queryset, chunk_size: int = 2000):
+    """Yields a flat dict by reference, with the EXPORT_COLUMNS"""
+    for values in queryset.values(*EXPORT_FIELDS, 'fields', 'payment', 'data').iterator(chunk_size=chunk_size):
+        row = {field: values[field] for field in EXPORT_FIELDS}
+        for name, (field, *keys) in JSON_KEYS.items():
+            value = values[field]
+            for key in keys:
+                value = (value or {}).get(key)
+            row[name] = value
+        yield row
+
+class Echo:
+    """File-like object that returns what is written, to stream csv.writer output"""
+    def write(self, value):
+        return value
+
+def iter_csv(queryset, chunk_size: int = 2000):
+    """Yields the CSV lines, header first"""
+    writer = csv.DictWriter(Echo(), fieldnames=EXPORT_COLUMNS)
+    yield writer.writeheader()
+    for row in iter_rows(queryset, chunk_size):
+        yield writer.writerow(row)
+
+def iter_jsonl(queryset, chunk_size: int = 2000):
+    """Yields a JSON object line by reference"""
+    for row in iter_rows(queryset, chunk_size):
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+def iter_export(queryset, format: str = 'csv', chunk_size: int = 2000):
+    return (iter_csv if format == 'csv' else iter_jsonl)(queryset, chunk_size)
+
+def write(queryset, file, format: str = 'csv', chunk_size: int = 2000):
+    """Writes the export to a text file object, returns the number of references written"""
+    count = -1 if format == 'csv' else 0
+    for line in iter_export(queryset, format, chunk_size):
+        file.write(line)
+        count += 1
+    return count
@@ -0,0 +1,164 @@
+###
+##  Django Proxypay Fees
+#
+#   Fees are configured with PROXYPAY['PROXYPAY_FEE'] and PROXYPAY['BANK_FEE'], in one of the forms:
+#   ('Proxypay', 0.25, 50, 1000)                       name, percent, min amount, max amount (cap)
+#   ('Bank', [(10000, 1, 50, None), (None, 0.5, 100, 2000)])   name, tiers: (up to amount, percent, min, max)
+#   A tier applies to amounts up to (and including) its first value, None meaning no limit
+
+import threading
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.utils.translation import gettext_lazy as _
+
+from .configs import conf
+from .exceptions import ProxypayValueError
+
+# ==============================================================================================
+
+CENTS = Decimal('0.01')
+
+def to_decimal(value):
+    """Exact Decimal from int, float, str or Decimal values. None stays None"""
+    if value is None or isinstance(value, Decimal):
+        return value
+    # str() gives the shortest repr of floats, 0.25 -> '0.25' not 0.2500000000000000055511151231257827
+    return Decimal(str(value))
+
+def to_json(fees):
+    """Fees dict with Decimals converted to floats, to store in JSONFields"""
+    if fees is None:
+        return None
+    return {key: float(value) if isinstance(value, Decimal) else value for key, value in fees.items()}
+
+def get_fee_values(amount, fees):
+    """
+    Fee columns of proxypay.models.Reference, from FeeSchedule.compute results or
+    from the fees stored in Reference.data
+    """
+    proxypay_fee = to_decimal((fees.get('proxypay_fee') or {}).get('expense') or 0)
+    bank_fee     = to_decimal((fees.get('bank_fee') or {}).get('expense') or 0)
+    fees_expense = (proxypay_fee + bank_fee).quantize(CENTS, ROUND_HALF_UP)
+    return {
+        'proxypay_fee': proxypay_fee.quantize(CENTS, ROUND_HALF_UP),
+        'bank_fee': bank_fee.quantize(CENTS, ROUND_HALF_UP),
+        'fees_expense': fees_expense,
+        'net_amount': to_decimal(amount) - fees_expense
+    }
+
+# ==============================================================================================
+
+class Fee:
+
+    """A compiled fee, a name and its tiers"""
+
+    def __init__(self, name, tiers):
+        self.name  = name
+        # (up_to, percent, min_amount, max_amount), sorted by up_to, None last
+        self.tiers = sorted(
+            (tuple(to_decimal(value) for value in tier) for tier in tiers),
+            key=lambda tier: (tier[0] is None, tier[0] or 0)
+        )
+
+    @classmethod
+    def from_setting(cls, setting):
+        try:
+            name, *values = setting
+            if len(values) == 1:
+                return cls(name, values[0])
+            percent, min_amount, max_amount = values
+            return cls(name, [(None, percent, min_amount, max_amount)])
+        except (TypeError, ValueError):
+            raise ProxypayValueError(_('Invalid fee: %s') % (setting,))
+
+    def get_tier(self, amount):
+        for tier in self.tiers:
+            if tier[0] is None or amount <= tier[0]:
+                return tier
+        return None
+
+    def compute(self, amount):
+        """
+        Returns the fee for an amount, as a dict of Decimals, or None if there is no fee:
+        {name, amount, net_amount, expense, fee_amount, applied_fee, applied_min_amount, applied_max_amount}
+        """
+        amount = to_decimal(amount)
+        tier   = self.get_tier(amount)
+        if not tier or not tier[1]:
+            return None
+
+        _up_to, percent, min_amount, max_amount = tier
+        fee_amount = (amount * percent / 100).quantize(CENTS, ROUND_HALF_UP)
+        if min_amount and fee_amount < min_amount:
+            expense = min_amount
+        elif max_amount and fee_amount > max_amount:
+            expense = max_amount
+        else:
+            expense = fee_amount
+        expense = expense.quantize(CENTS, ROUND_HALF_UP)
+
+        return {
+            'name': self.name,
+            'amount': amount,
+            'net_amount': amount - expense,
+            'expense': expense,
+            'fee_amount': fee_amount,
+            'applied_fee': percent,
+            'applied_min_amount': min_amount,
+            'applied_max_amount': max_amount
+        }
+
+# ==============================================================================================
+
+class FeeSchedule:
+
+    """
+    Proxypay and bank fees, compiled from the settings.
+    Use get_fee_schedule() to get the cached schedule for the current settings
+    """
+
+    def __init__(self, proxypay_fee, bank_fee):
+        self.proxypay_fee = Fee.from_setting(proxypay_fee)
+        self.bank_fee     = Fee.from_setting(bank_fee)
+
+    def compute(self, amount):
+        """Returns {'proxypay_fee': {...} or None, 'bank_fee': {...} or None}, with Decimal values"""
+        return {
+            'proxypay_fee': self.proxypay_fee.compute(amount),
+            'bank_fee': self.bank_fee.compute(amount)
+        }
+
+    def compute_many(self, amounts):
+        """compute for many amounts at once, returns a list in the same order"""
+        return [self.compute(amount) for amount in amounts]
+
+    def compute_queryset(self, queryset, chunk_size: int = 2000):
+        """
+        compute for every reference of a queryset, in one pass over the database.
+        Yields tuples (pk, fees), loading only the amounts
+        """
+        for pk, amount in queryset.values_list('pk', 'amount').iterator(chunk_size=chunk_size):
+            yield pk, self.compute(amount)
+
+    def expense(self, amount):
+        """Total expense (proxypay + bank fees) for an amount"""
+        return sum(
+            (fee['expense'] for fee in self.compute(amount).values() if fee),
+            Decimal('0.00')
+        )
+
+# ==============================================================================================
+
+_cache      = (None, None)
+_cache_lock = threading.Lock()
+
+def get_fee_schedule():
+    """Returns the FeeSchedule for the current settings, compiled once until the settings change"""
+    global _cache
+    key = (repr(conf.PROXYPAY_FEE), repr(conf.BANK_FEE))
+    cached_key, schedule = _cache
+    if cached_key != key:
+        with _cache_lock:
+            schedule = FeeSchedule(conf.PROXYPAY_FEE, conf.BANK_FEE)
+            _cache   = (key, schedule)
+    return schedule
@@ -1,18 +1,54 @@
+import os
+import signal
+import threading
+import time
+
 from django.core.management.base import BaseCommand
+from django.db import close_old_connections
 from django.utils.translation import gettext_lazy as _
 
+from proxypay import export, rollups
 from proxypay.api import api
-from proxypay.references import get
+from proxypay.payments import reconcile, drain_inbox
+from proxypay.references import get, pool
 from proxypay.configs import conf
 
 # =====================================================================================================================
 
 class Command(BaseCommand):
 
-    help = _('For testing payments with Proxypay in the development environment')
+    help = _(
+        'pay <reference>: fictitious payment in the development environment | '
+        'refill_pool [size]: reserves reference ids from Proxypay | '
+        'reconcile: recognizes pending payments, polling Proxypay until stopped | '
+        'inbox: applies the payments received by the webhook in inbox mode, until stopped | '
+        'rebuild_rollup: rebuilds the daily revenue rollup from the references | '
+        'export: exports the references as CSV or JSON Lines | '
+        'renew: renews the waiting references expired or about to expire | '
+        'purge: deletes the waiting references expired for a while, in Proxypay and in the database'
+    )
 
     def add_arguments(self, parser):
         parser.add_argument('command', nargs='+', type=str)
+        # reconcile
+        parser.add_argument('--interval', type=float, default=5, help=_('seconds between polls while there are payments'))
+        parser.add_argument('--max-interval', type=float, default=60, help=_('max seconds between polls when the backlog is empty'))
+        parser.add_argument('--concurrency', type=int, default=10, help=_('simultaneous requests to Proxypay'))
+        parser.add_argument('--once', action='store_true', help=_('run a single cycle and exit'))
+        # inbox
+        parser.add_argument('--batch-size', type=int, default=100, help=_('inbox payments applied per transaction'))
+        # chunked commands
+        parser.add_argument('--chunk-size', type=int, default=10000, help=_('references read per query'))
+        # export
+        parser.add_argument('--format', choices=export.FORMATS, default='csv', help=_('export format'))
+        parser.add_argument('--output', default=None, help=_('export file, standard output by default'))
+        # renew
+        parser.add_argument('--hours-before', type=float, default=0, help=_('renew references expiring in the next hours'))
+        parser.add_argument('--expired-within', type=float, default=None, help=_('only renew references expired in the last hours'))
+        parser.add_argument('--days', type=int, default=None, help=_('days for expiration'))
+        # purge
+        parser.add_argument('--grace-hours', type=float, default=24, help=_('purge references expired for more than these hours'))
+        parser.add_argument('--checkpoint', default=None, help=_('file to keep the progress, to resume an interrupted purge'))
 
     def handle(self, *args, **options):
         args = options.pop('command')
@@ -37,4 +73,186 @@ class Command(BaseCommand):
             else:
                 self.stdout.write(self.style.ERROR(
                     _("Proxypay returns '%d' status code from API") % r.status_code
-                ))
\ No newline at end of file
+                ))
+        # reserve reference ids
+        elif args[0] == 'refill_pool':
+            added = pool.refill(int(args[1]) if len(args) > 1 else None)
+            self.stdout.write(self.style.SUCCESS(_("%d reference ids reserved") % added))
+        # recognize payments
+        elif args[0] == 'reconcile':
+            self.reconcile(**options)
+
+        # apply inbox payments
+        elif args[0] == 'inbox':
+            self.inbox(**options)
+
+        # rebuild the daily revenue rollup
+        elif args[0] == 'rebuild_rollup':
+            self.stdout.write(self.style.WARNING(_('The rollup is locked until the end of the rebuild, payments wait for it')))
+            rows = rollups.rebuild(chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(_("Daily revenue rollup rebuilt, %d rows") % rows))
+
+        # export references
+        elif args[0] == 'export':
+            self.export(**options)
+
+        # renew references
+        elif args[0] == 'renew':
+            self.renew(**options)
+
+        # purge references
+        elif args[0] == 'purge':
+            self.purge(**options)
+
+    # ---------------------------------------------------------------------------------------------------------------------
+
+    def stopping_event(self):
+        """Event set on SIGINT or SIGTERM, for a graceful stop of long running commands"""
+
+        stopping = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write(_('Stopping after the current cycle...'))
+            stopping.set()
+
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, stop)
+        return stopping
+
+    def reconcile(self, interval, max_interval, concurrency, once, **options):
+        """
+        Polls the Proxypay payments backlog. The interval doubles up to max_interval while the
+        backlog is empty, and goes back to interval as soon as payments are found.
+        Stops gracefully on SIGINT or SIGTERM, after the running cycle
+        """
+
+        stopping = self.stopping_event()
+        cycle, wait = 0, interval
+        while not stopping.is_set():
+            cycle += 1
+            close_old_connections()
+            started = time.monotonic()
+            try:
+                summary = reconcile(concurrency=concurrency)
+            except Exception as e:
+                summary = None
+                self.stdout.write(self.style.ERROR(_("Cycle %d failed: %s") % (cycle, e)))
+            elapsed = time.monotonic() - started
+
+            if summary:
+                # failed payments are also in matched or unmatched
+                total = len(summary['matched']) + len(summary['unmatched'])
+                self.stdout.write(
+                    _("Cycle %(cycle)d: %(matched)d matched, %(unmatched)d unmatched, %(failed)d failed "
+                      "in %(elapsed).3fs (%(rate).1f payments/s)") % {
+                        'cycle': cycle,
+                        'matched': len(summary['matched']),
+                        'unmatched': len(summary['unmatched']),
+                        'failed': len(summary['failed']),
+                        'elapsed': elapsed,
+                        'rate': total / elapsed if elapsed else 0
+                    }
+                )
+
+            if once:
+                break
+            # adaptive backoff
+            wait = interval if summary and summary['matched'] else min(wait * 2, max_interval)
+            stopping.wait(wait)
+
+    def inbox(self, interval, batch_size, once, **options):
+        """
+        Drains the webhook inbox batch by batch, waiting <interval> seconds when it is empty.
+        Several workers can run at the same time. Stops gracefully on SIGINT or SIGTERM
+        """
+
+        stopping = self.stopping_event()
+        while not stopping.is_set():
+            close_old_connections()
+            started = time.monotonic()
+            handled = drain_inbox(batch_size=batch_size)
+            if handled:
+                elapsed = time.monotonic() - started
+                self.stdout.write(_("%(handled)d inbox payments applied in %(elapsed).3fs") % {
+                    'handled': handled,
+                    'elapsed': elapsed
+                })
+            if once:
+                break
+            if handled < batch_size:
+                stopping.wait(interval)
+
+    def export(self, format, output, chunk_size, **options):
+        """Streams all references to a file or the standard output"""
+
+        from proxypay.models import Reference
+
+        queryset = Reference.objects.order_by('pk')
+        if output:
+            with open(output, 'w', newline='', encoding='utf-8') as file:
+                count = export.write(queryset, file, format, chunk_size)
+            self.stderr.write(self.style.SUCCESS(_("%(count)d references exported to %(output)s") % {
+                'count': count,
+                'output': output
+            }))
+        else:
+            export.write(queryset, self.stdout, format, chunk_size)
+
+    def renew(self, hours_before, expired_within, days, concurrency, chunk_size, **options):
+        """Renews the waiting references expired, or expiring in the next <hours_before> hours"""
+
+        from proxypay.models import Reference
+
+        started = time.monotonic()
+        renewed, failures = Reference.objects.expiring(hours_before, expired_within).renew(
+            days=days,
+            concurrency=concurrency,
+            chunk_size=chunk_size
+        )
+        self.stdout.write(self.style.SUCCESS(_("%(renewed)d references renewed in %(elapsed).3fs") % {
+            'renewed': renewed,
+            'elapsed': time.monotonic() - started
+        }))
+        for reference in failures:
+            self.stdout.write(self.style.ERROR(_("Reference '%s' not renewed") % reference.reference))
+
+    def purge(self, grace_hours, concurrency, chunk_size, checkpoint, **options):
+        """
+        Deletes the waiting references expired for more than <grace_hours> hours.
+        With a checkpoint file, an interrupted purge resumes from the last deleted chunk
+        """
+
+        from proxypay.models import Reference
+
+        start_after = 0
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as file:
+                start_after = int(file.read().strip() or 0)
+            self.stdout.write(_("Resuming after reference pk %d") % start_after)
+
+        def save_checkpoint(last_pk, deleted):
+            if checkpoint:
+                with open(f"{checkpoint}.tmp", 'w') as file:
+                    file.write(str(last_pk))
+                os.replace(f"{checkpoint}.tmp", checkpoint)
+            self.stdout.write(_("%(deleted)d references deleted, up to pk %(last_pk)d") % {
+                'deleted': deleted,
+                'last_pk': last_pk
+            })
+
+        started = time.monotonic()
+        deleted, failures = Reference.objects.stale(grace_hours).purge(
+            concurrency=concurrency,
+            chunk_size=chunk_size,
+            start_after=start_after,
+            on_chunk=save_checkpoint
+        )
+        if checkpoint and os.path.exists(checkpoint):
+            # completed
+            os.remove(checkpoint)
+        self.stdout.write(self.style.SUCCESS(_("%(deleted)d references purged in %(elapsed).3fs") % {
+            'deleted': deleted,
+            'elapsed': time.monotonic() - started
+        }))
+        for reference in failures:
+            self.stdout.write(self.style.ERROR(_("Reference '%s' not deleted in Proxypay") % reference.reference))
\ No newline at end of file
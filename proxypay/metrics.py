@@ -0,0 +1,191 @@
+###
+##  Django Proxypay Metrics
+#
+#   Latency and error metrics of the Proxypay API calls and the webhook, kept by a pluggable
+#   backend set with PROXYPAY['METRICS_BACKEND'] (a dotted path, None to disable):
+#   proxypay.metrics.InMemoryBackend   counters and histograms of the process, in Prometheus text format
+#   proxypay.metrics.NullBackend       discards everything
+#   A custom backend implements increment, observe and render, see MetricsBackend
+
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.utils.module_loading import import_string
+
+from .configs import conf
+
+# ==============================================================================================
+
+# latency histograms buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# name: (type, help)
+METRICS = {
+    'proxypay_api_request_duration_seconds': ('histogram', 'Duration of the Proxypay API requests'),
+    'proxypay_api_responses_total': ('counter', 'Proxypay API responses by status code'),
+    'proxypay_api_timeouts_total': ('counter', 'Proxypay API requests that timed out'),
+    'proxypay_api_errors_total': ('counter', 'Proxypay API requests failed without a response'),
+    'proxypay_api_retries_total': ('counter', 'Proxypay API requests retried'),
+    'proxypay_api_hedged_total': ('counter', 'Hedged Proxypay API requests sent, and won by the hedge'),
+    'proxypay_rate_limit_wait_seconds': ('histogram', 'Time waited for the client side rate limit'),
+    'proxypay_rate_limited_total': ('counter', 'Proxypay API calls refused by the client side rate limit'),
+    'proxypay_circuit_opened_total': ('counter', 'Times the Proxypay circuit breaker opened'),
+    'proxypay_circuit_refused_total': ('counter', 'Proxypay API calls refused by the open circuit breaker'),
+    'proxypay_webhooks_total': ('counter', 'Proxypay webhook payments by result'),
+    'proxypay_reference_cache_total': ('counter', 'Reference cache lookups by result'),
+    'proxypay_signal_receiver_duration_seconds': ('histogram', 'Signal receivers duration by signal and receiver'),
+    'proxypay_signal_receiver_errors_total': ('counter', 'Signal receivers errors by signal and receiver'),
+    'proxypay_signal_dispatch_inline_total': ('counter', 'Signal dispatches run in the caller, thread pool queue full'),
+}
+
+def normalize_path(path):
+    """Endpoint of a path, without ids: /references/123456789 -> /references/{id}"""
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path.split('?', 1)[0])
+
+def is_timeout(error):
+    """True for the timeout errors of requests, urllib3, httpx and the standard library"""
+    return isinstance(error, TimeoutError) or any(
+        'Timeout' in cls.__name__ for cls in type(error).__mro__
+    )
+
+# ==============================================================================================
+
+class MetricsBackend:
+
+    """Base metrics backend, labels are dicts of strings"""
+
+    def increment(self, name, labels=None, value=1):
+        raise NotImplementedError
+
+    def observe(self, name, value, labels=None):
+        raise NotImplementedError
+
+    def render(self):
+        """Metrics in Prometheus text format"""
+        return ''
+
+class NullBackend(MetricsBackend):
+
+    def increment(self, name, labels=None, value=1):
+        pass
+
+    def observe(self, name, value, labels=None):
+        pass
+
+class InMemoryBackend(MetricsBackend):
+
+    """Counters and histograms of the current process, thread safe"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets    = tuple(sorted(buckets))
+        self.counters   = {}    # (name, labels): value
+        self.histograms = {}    # (name, labels): [bucket counts, sum, count]
+        self.lock       = threading.Lock()
+
+    def increment(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            if (histogram := self.histograms.get(key)) is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def snapshot(self):
+        """Copy of the counters and histograms, {'counters': {...}, 'histograms': {...}}"""
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def render(self):
+        snapshot = self.snapshot()
+        series   = {}
+        for (name, labels), value in sorted(snapshot['counters'].items()):
+            series.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (buckets, total, count) in sorted(snapshot['histograms'].items()):
+            lines = series.setdefault(name, [])
+            for bound, bucket in zip(self.buckets, buckets):
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {bucket}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        output = []
+        for name in sorted(series):
+            kind, description = METRICS.get(name, ('untyped', name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(series[name])
+        return '\n'.join(output) + '\n' if output else ''
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+# ==============================================================================================
+
+_backend      = (None, None)
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Returns the metrics backend for the current settings, built once until the settings change"""
+    global _backend
+    path = conf.METRICS_BACKEND
+    cached_path, backend = _backend
+    if backend is None or cached_path != path:
+        with _backend_lock:
+            cached_path, backend = _backend
+            if backend is None or cached_path != path:
+                backend  = import_string(path)() if path else NullBackend()
+                _backend = (path, backend)
+    return backend
+
+def increment(name, labels=None, value=1):
+    get_backend().increment(name, labels, value)
+
+def observe(name, value, labels=None):
+    get_backend().observe(name, value, labels)
+
+# ==============================================================================================
+
+@contextmanager
+def track_request(method, path):
+    """
+    Measures a Proxypay API request: the latency, the response status (set with
+    the yielded function) and the timeouts and errors raised
+    """
+
+    labels  = {'method': method, 'endpoint': normalize_path(path)}
+    started = time.perf_counter()
+    try:
+        yield lambda status: increment('proxypay_api_responses_total', {**labels, 'status': str(status)})
+    except Exception as e:
+        increment('proxypay_api_timeouts_total' if is_timeout(e) else 'proxypay_api_errors_total', labels)
+        raise
+    finally:
+        observe('proxypay_api_request_duration_seconds', time.perf_counter() - started, labels)
+
+def retried(method, path):
+    increment('proxypay_api_retries_total', {'method': method, 'endpoint': normalize_path(path)})
+
+def webhook(result, source='view'):
+    """Counts a webhook payment: processed, unrecognized, rejected, queued or failed"""
+    increment('proxypay_webhooks_total', {'result': result, 'source': source})
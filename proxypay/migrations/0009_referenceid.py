@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxypay', '0008_auto_20210622_0841'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenceId',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reference', models.CharField(max_length=100, unique=True, verbose_name='reference')),
+                ('reserved_at', models.DateTimeField(auto_now_add=True, verbose_name='reserved at')),
+            ],
+            options={
+                'verbose_name': 'Reserved Reference Id',
+                'verbose_name_plural': 'Reserved Reference Ids',
+            },
+        ),
+    ]
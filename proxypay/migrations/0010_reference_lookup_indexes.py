@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxypay', '0009_referenceid'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reference',
+            index=models.Index(fields=['reference', 'status', 'expires_in'], name='proxypay_ref_lookup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reference',
+            index=models.Index(condition=models.Q(('status', 0)), fields=['reference', 'expires_in'], name='proxypay_ref_waiting_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxypay', '0010_reference_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InboxPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payload', models.TextField(verbose_name='payload')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('error', models.TextField(blank=True, default='', verbose_name='error')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='received at')),
+                ('processed_at', models.DateTimeField(default=None, null=True, verbose_name='processed at')),
+            ],
+            options={
+                'verbose_name': 'Inbox Payment',
+                'verbose_name_plural': 'Inbox Payments',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='inboxpayment',
+            index=models.Index(condition=models.Q(('processed_at__isnull', True)), fields=['id'], name='proxypay_inbox_pending_idx'),
+        ),
+    ]
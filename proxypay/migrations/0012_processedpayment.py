@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxypay', '0011_inboxpayment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessedPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payment_id', models.CharField(max_length=100, unique=True, verbose_name='payment id')),
+                ('processed_at', models.DateTimeField(auto_now_add=True, verbose_name='processed at')),
+                ('reference', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='processed_payments', to='proxypay.reference', verbose_name='reference')),
+            ],
+            options={
+                'verbose_name': 'Processed Payment',
+                'verbose_name_plural': 'Processed Payments',
+            },
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:56
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+CHUNK_SIZE = 2000
+CENTS = Decimal('0.01')
+
+
+def get_expense(data, name):
+    return Decimal(str((data.get(name) or {}).get('expense') or 0)).quantize(CENTS, ROUND_HALF_UP)
+
+
+def backfill_fee_columns(apps, schema_editor):
+    """Fills the fee columns from the fees stored in Reference.data, chunk by chunk"""
+    Reference = apps.get_model('proxypay', 'Reference')
+    last_pk = 0
+    while True:
+        references = list(
+            Reference.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', 'amount', 'data')[:CHUNK_SIZE]
+        )
+        if not references:
+            break
+        for reference in references:
+            data = reference.data or {}
+            reference.proxypay_fee = get_expense(data, 'proxypay_fee')
+            reference.bank_fee = get_expense(data, 'bank_fee')
+            reference.fees_expense = reference.proxypay_fee + reference.bank_fee
+            reference.net_amount = reference.amount - reference.fees_expense
+        Reference.objects.bulk_update(references, ['proxypay_fee', 'bank_fee', 'fees_expense', 'net_amount'])
+        last_pk = references[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxypay', '0012_processedpayment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reference',
+            name='bank_fee',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='bank fee'),
+        ),
+        migrations.AddField(
+            model_name='reference',
+            name='fees_expense',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='fees expense'),
+        ),
+        migrations.AddField(
+            model_name='reference',
+            name='net_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='net amount'),
+        ),
+        migrations.AddField(
+            model_name='reference',
+            name='proxypay_fee',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='proxypay fee'),
+        ),
+        migrations.RunPython(backfill_fee_columns, migrations.RunPython.noop),
+    ]
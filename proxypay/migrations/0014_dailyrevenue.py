@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxypay', '0013_reference_fee_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='day')),
+                ('entity', models.CharField(blank=True, default='', max_length=100, verbose_name='entity')),
+                ('paid_count', models.PositiveIntegerField(default=0, verbose_name='paid references')),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='amount')),
+                ('fees_expense', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='fees expense')),
+                ('net_amount', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='net amount')),
+            ],
+            options={
+                'verbose_name': 'Daily Revenue',
+                'verbose_name_plural': 'Daily Revenues',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrevenue',
+            constraint=models.UniqueConstraint(fields=('day', 'entity'), name='proxypay_daily_revenue_unique'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxypay', '0014_dailyrevenue'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reference',
+            index=models.Index(fields=['status', 'expires_in'], name='proxypay_ref_expiring_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('proxypay', '0015_reference_expiring_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inboxpayment',
+            name='retry_at',
+            field=models.DateTimeField(default=None, null=True, verbose_name='retry at'),
+        ),
+    ]
@@ -1,16 +1,19 @@
-import decimal
-from django.db import models
+import datetime
+from asgiref.sync import sync_to_async
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 from django.utils.timezone import now
 
 from django_admin_display import admin_display as d
 
-from .api import api
+from .api import api, async_api
 from .utils import (
     get_validated_data_for_reference_creation,
     get_decimal_value,
     str_to_datetime
 )
+from . import deadlines, dispatch, rollups
+from .references import cache as reference_cache
 from .exceptions import ProxypayException
 from .signals import reference_paid, reference_created
 
@@ -25,7 +28,67 @@ PAYMENT_STATUS_PAID = 1
 
 # ==========================================================================================================
 
-class ReferenceModelManager(models.Manager):
+###
+## Reference JSON Keys
+#  Values of the json fields shown by the admin and exported, as: name: (json field, key, ...)
+#
+
+JSON_KEYS = {
+    'payment_period_id': ('payment', 'period_id'),
+    'payment_period_start_datetime': ('payment', 'period_start_datetime'),
+    'payment_period_end_datetime': ('payment', 'period_end_datetime'),
+    'payment_location': ('payment', 'terminal_location'),
+    'payment_tarminal_type': ('payment', 'terminal_type'),
+    'payment_tarminal_id': ('payment', 'terminal_id'),
+    'payment_transaction_id': ('payment', 'transaction_id'),
+    'payment_product_id': ('payment', 'product_id'),
+    'product': ('fields', 'product'),
+    'service': ('fields', 'service'),
+    'bank_name': ('data', 'bank_fee', 'name'),
+    'bank_net_amount': ('data', 'bank_fee', 'net_amount'),
+    'bank_fee_percent': ('data', 'bank_fee', 'applied_fee'),
+    'bank_fee_amount': ('data', 'bank_fee', 'fee_amount'),
+    'bank_fee_min_amount': ('data', 'bank_fee', 'applied_min_amount'),
+    'bank_fee_max_amount': ('data', 'bank_fee', 'applied_max_amount'),
+    'proxypay_net_amount': ('data', 'proxypay_fee', 'net_amount'),
+    'proxypay_fee_percent': ('data', 'proxypay_fee', 'applied_fee'),
+    'proxypay_fee_amount': ('data', 'proxypay_fee', 'fee_amount'),
+    'proxypay_fee_min_amount': ('data', 'proxypay_fee', 'applied_min_amount'),
+    'proxypay_fee_max_amount': ('data', 'proxypay_fee', 'applied_max_amount'),
+}
+
+# ==========================================================================================================
+
+class ReferenceQuerySet(models.QuerySet):
+
+    def waiting(self):
+        return self.filter(status=PAYMENT_STATUS_WAITING)
+
+    def expiring(self, hours: float = 0, expired_within: float = None):
+        """
+        Waiting references expired or expiring in the next <hours> hours.
+        expired_within limits the expired ones to those expired in the last <expired_within> hours
+        """
+        queryset = self.waiting().filter(expires_in__lt=now() + datetime.timedelta(hours=hours))
+        if expired_within is not None:
+            queryset = queryset.filter(expires_in__gte=now() - datetime.timedelta(hours=expired_within))
+        return queryset
+
+    def renew(self, days: int = None, concurrency: int = 10, chunk_size: int = 1000):
+        """Renews the references in Proxypay, see proxypay.references.renew"""
+        from .references.renew import renew
+        return renew(self, days=days, concurrency=concurrency, chunk_size=chunk_size)
+
+    def stale(self, hours: float = 0):
+        """Waiting references expired for more than <hours> hours"""
+        return self.waiting().filter(expires_in__lt=now() - datetime.timedelta(hours=hours))
+
+    def purge(self, concurrency: int = 10, chunk_size: int = 1000, start_after: int = 0, on_chunk=None):
+        """Deletes the references in Proxypay and in the database, see proxypay.references.purge"""
+        from .references.purge import purge
+        return purge(self, concurrency=concurrency, chunk_size=chunk_size, start_after=start_after, on_chunk=on_chunk)
+
+class ReferenceModelManager(models.Manager.from_queryset(ReferenceQuerySet)):
 
     def is_available(self, reference):
         return not self.filter(
@@ -34,6 +97,19 @@ class ReferenceModelManager(models.Manager):
             expires_in__gt=now()
         ).exists() if reference else False
 
+    def available(self, references):
+        """
+        Bulk version of is_available, returns the set of
+        references (from the given ones) that are not in use
+        """
+        references = {str(reference) for reference in references if reference}
+        in_use = set(self.filter(
+            reference__in=references,
+            status=PAYMENT_STATUS_WAITING,
+            expires_in__gt=now()
+        ).values_list('reference', flat=True))
+        return references - in_use
+
     def get_reference(self, reference):
         return self.filter(
             reference=reference,
@@ -44,18 +120,50 @@ class ReferenceModelManager(models.Manager):
     def create(self, **kwargs):
         # creating the signal and add additional data
         reference = super(ReferenceModelManager, self).create(**kwargs)
+        # cached misses
+        reference_cache.invalidate([reference], using=reference._state.db)
         # Dispatching Signal
-        reference_created.send(
+        dispatch.send(
+            reference_created,
             reference.__class__, 
             reference=reference
         )
         return reference
 
+class ReferenceId(models.Model):
+
+    """
+    Reference ids reserved in Proxypay ahead of time,
+    see proxypay.references.pool
+    """
+    
+    class Meta:
+        verbose_name = _('Reserved Reference Id')
+        verbose_name_plural = _('Reserved Reference Ids')
+
+    reference   = models.CharField(_('reference'), max_length=100, unique=True)
+    reserved_at = models.DateTimeField(_('reserved at'), auto_now_add=True)
+
+    def __str__(self):
+        return self.reference
+
 class Reference(models.Model):
     
     class Meta:
         verbose_name = _('Reference')
         verbose_name_plural = _('References')
+        indexes = [
+            # ReferenceModelManager.is_available and get_reference lookups
+            models.Index(fields=['reference', 'status', 'expires_in'], name='proxypay_ref_lookup_idx'),
+            # smaller index with only the waiting references, on backends with partial indexes support
+            models.Index(
+                fields=['reference', 'expires_in'],
+                name='proxypay_ref_waiting_idx',
+                condition=models.Q(status=PAYMENT_STATUS_WAITING)
+            ),
+            # waiting references by expiration, ReferenceQuerySet.expiring
+            models.Index(fields=['status', 'expires_in'], name='proxypay_ref_expiring_idx'),
+        ]
     
     class Status(models.IntegerChoices):
         WAITING = PAYMENT_STATUS_WAITING, _('Waitng')
@@ -67,6 +175,12 @@ class Reference(models.Model):
     amount              = models.DecimalField(_('amount'), max_digits=12, decimal_places=2)
     entity              = models.CharField(_('entity'), max_length=100, null=True, default=None, editable=False)
     
+    # fees, from the data fees, see proxypay.fees
+    proxypay_fee        = models.DecimalField(_('proxypay fee'), max_digits=12, decimal_places=2, default=0, editable=False)
+    bank_fee            = models.DecimalField(_('bank fee'), max_digits=12, decimal_places=2, default=0, editable=False)
+    fees_expense        = models.DecimalField(_('fees expense'), max_digits=12, decimal_places=2, default=0, editable=False)
+    net_amount          = models.DecimalField(_('net amount'), max_digits=12, decimal_places=2, default=0, editable=False)
+    
     # reference payment status: paid, expired, waiting
     status              = models.IntegerField(_('status'), default=Status.WAITING, choices=Status.choices, editable=False)
 
@@ -112,29 +226,6 @@ class Reference(models.Model):
     def is_paid(self):
         return self.status == Reference.Status.PAID
     
-    @property
-    @d(short_description=_('Proxypay Fee'))
-    def proxypay_fee(self):
-        if (fee := self.data.get('proxypay_fee')):
-            return fee.get('expense', 0)
-        return 0
-    
-    @property
-    @d(short_description=_('Bank Fee'))
-    def bank_fee(self):
-        if (fee := self.data.get('bank_fee')):
-            return fee.get('expense', 0)
-        return 0
-        
-    @property
-    @d(short_description=_('Fees Expense'))
-    def fees_expense(self):
-        return decimal.Decimal('%.2f' % (self.proxypay_fee + self.bank_fee))
-    
-    @property
-    @d(short_description=_('Net Amount'))
-    def net_amount(self):
-        return self.amount - self.fees_expense
 
     # --------------------------------------------------------------------------------------------
     ###
@@ -145,49 +236,115 @@ class Reference(models.Model):
         """Delete payment reference from Proxypay and Database"""
         deleted = api.delete_reference(self.reference)
         if deleted:
-            return super(Reference, self).delete()
+            result = super(Reference, self).delete()
+            reference_cache.invalidate([self], using=self._state.db)
+            return result
         raise ProxypayException(_('Error when trying to delete the reference in the Proxypay'))
 
     def paid(self, payment_data):
         """
         Update reference payment status to paid
         Suitable for use with Proxypay's Webhook
+        Safe under concurrent webhooks and payment checks: the payment is applied with a
+        conditional update and recorded in ProcessedPayment, so a payment is applied and
+        signaled only once. Returns True if the payment was applied by this call
+        """
+        if self.payment:
+            return False
+        payment_id = payment_data.get('id')
+        if payment_id is not None and ProcessedPayment.objects.filter(payment_id=payment_id).exists():
+            # duplicate, webhook retry
+            return False
+
+        self.set_payment(payment_data)
+        self.updated_at = now()
+        with transaction.atomic():
+            updated = Reference.objects.filter(pk=self.pk, status=Reference.Status.WAITING).update(
+                payment=self.payment,
+                status=self.status,
+                paid_at=self.paid_at,
+                updated_at=self.updated_at
+            )
+            if updated and payment_id is not None:
+                ProcessedPayment.objects.create(payment_id=payment_id, reference=self)
+            if updated:
+                rollups.record([self])
+        reference_cache.invalidate([self], using=self._state.db)
+
+        if not updated:
+            # already paid by someone else
+            self.refresh_from_db(fields=['payment', 'status', 'paid_at', 'updated_at'])
+            return False
+        self.__dispatch_paid_signal()
+        return True
+
+    def set_payment(self, payment_data):
         """
-        if not self.payment:
-            # passando os dados de pagamento na instancia
-            self.payment = payment_data
-            self.status  = Reference.Status.PAID
-            try:
-                self.paid_at = str_to_datetime(self.payment.get('datetime'))
-            except:
-                self.paid_at = now()  
-            self.save()
-            self.__dispatch_paid_signal()
-
-    def check_payment(self):
+        Sets the payment data and paid status on the instance, without saving
+        """
+        # passando os dados de pagamento na instancia
+        self.payment = payment_data
+        self.status  = Reference.Status.PAID
+        try:
+            self.paid_at = str_to_datetime(self.payment.get('datetime'))
+        except:
+            self.paid_at = now()
+
+    def check_payment(self, deadline: float = None):
         """
         Checks whether the referral payment has already been processed.
         Initially check on the instanse, if it is not processed, check the Proxypay API to be sure. 
-        Returns payment data or false
+        Returns payment data or false. deadline limits the seconds spent in the Proxypay calls
         """
-        if not self.payment:
-            if (payment := api.check_reference_payment(self.reference)):
-                self.paid(payment)
-                return payment
-            return False
-        return self.payment
+        with deadlines.deadline(deadline):
+            if not self.payment:
+                if (payment := api.check_reference_payment(self.reference)):
+                    self.paid(payment)
+                    return payment
+                return False
+            return self.payment
+
+    async def acheck_payment(self, deadline: float = None):
+        """
+        Async version of check_payment
+        """
+        with deadlines.deadline(deadline):
+            if not self.payment:
+                if (payment := await async_api.check_reference_payment(self.reference)):
+                    await sync_to_async(self.paid)(payment)
+                    return payment
+                return False
+            return self.payment
     
 
-    def update(self):
-        if self.expired:
-            data        = get_validated_data_for_reference_creation(float(self.amount), self.fields)
-            datetime    = data.pop('datetime')
-            # updating
-            if api.create_or_update_reference(self.reference, data=data):
-                self.expires_in = datetime.replace(hour=23,minute=59,second=59)
-                self.save()
-                return True
-        return False
+    def update(self, deadline: float = None):
+        with deadlines.deadline(deadline):
+            if self.expired():
+                data        = get_validated_data_for_reference_creation(float(self.amount), self.fields)
+                datetime    = data.pop('datetime')
+                # updating
+                if api.create_or_update_reference(self.reference, data=data):
+                    self.expires_in = datetime.replace(hour=23,minute=59,second=59)
+                    self.save()
+                    reference_cache.invalidate([self], using=self._state.db)
+                    return True
+            return False
+
+    async def aupdate(self, deadline: float = None):
+        """
+        Async version of update
+        """
+        with deadlines.deadline(deadline):
+            if self.expired():
+                data        = get_validated_data_for_reference_creation(float(self.amount), self.fields)
+                datetime    = data.pop('datetime')
+                # updating
+                if await async_api.create_or_update_reference(self.reference, data=data):
+                    self.expires_in = datetime.replace(hour=23,minute=59,second=59)
+                    await sync_to_async(self.save)()
+                    await sync_to_async(reference_cache.invalidate)([self], using=self._state.db)
+                    return True
+            return False
 
     # --------------------------------------------------------------------------------------------
     ###
@@ -206,8 +363,85 @@ class Reference(models.Model):
     #
 
     def __dispatch_paid_signal(self):
-        reference_paid.send(
+        dispatch.send(
+            reference_paid,
             self.__class__, 
             reference=self
         )
-        
\ No newline at end of file
+
+# ==========================================================================================================
+
+class ProcessedPayment(models.Model):
+
+    """
+    Proxypay payments already applied to a reference,
+    makes applying the same payment twice a single indexed lookup
+    """
+    
+    class Meta:
+        verbose_name = _('Processed Payment')
+        verbose_name_plural = _('Processed Payments')
+
+    payment_id   = models.CharField(_('payment id'), max_length=100, unique=True)
+    reference    = models.ForeignKey(Reference, models.CASCADE, related_name='processed_payments', verbose_name=_('reference'))
+    processed_at = models.DateTimeField(_('processed at'), auto_now_add=True)
+
+    def __str__(self):
+        return self.payment_id
+
+# ==========================================================================================================
+
+class DailyRevenue(models.Model):
+
+    """
+    Paid references totals by day (of payment) and entity, kept up to date
+    when payments are applied, see proxypay.rollups
+    """
+    
+    class Meta:
+        verbose_name = _('Daily Revenue')
+        verbose_name_plural = _('Daily Revenues')
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'entity'], name='proxypay_daily_revenue_unique'),
+        ]
+
+    day          = models.DateField(_('day'))
+    entity       = models.CharField(_('entity'), max_length=100, blank=True, default='')
+    paid_count   = models.PositiveIntegerField(_('paid references'), default=0)
+    amount       = models.DecimalField(_('amount'), max_digits=16, decimal_places=2, default=0)
+    fees_expense = models.DecimalField(_('fees expense'), max_digits=16, decimal_places=2, default=0)
+    net_amount   = models.DecimalField(_('net amount'), max_digits=16, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.day} {self.entity}"
+
+# ==========================================================================================================
+
+class InboxPayment(models.Model):
+
+    """
+    Raw payments received by the webhook in inbox mode (WEBHOOK_INBOX),
+    applied later by the worker, see proxypay.payments.drain_inbox
+    """
+    
+    class Meta:
+        verbose_name = _('Inbox Payment')
+        verbose_name_plural = _('Inbox Payments')
+        indexes = [
+            models.Index(
+                fields=['id'],
+                name='proxypay_inbox_pending_idx',
+                condition=models.Q(processed_at__isnull=True)
+            ),
+        ]
+
+    payload      = models.TextField(_('payload'))
+    attempts     = models.PositiveIntegerField(_('attempts'), default=0)
+    error        = models.TextField(_('error'), blank=True, default='')
+    received_at  = models.DateTimeField(_('received at'), auto_now_add=True)
+    processed_at = models.DateTimeField(_('processed at'), null=True, default=None)
+    # not retried before, after a failure
+    retry_at     = models.DateTimeField(_('retry at'), null=True, default=None)
+
+    def __str__(self):
+        return _("Inbox payment: '%s'") % self.pk
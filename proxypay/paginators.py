@@ -0,0 +1,83 @@
+###
+##  Django Proxypay Paginators
+#
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# ==============================================================================================
+
+# below this number of rows, counting is cheap enough to be exact
+EXACT_COUNT_THRESHOLD = 100000
+
+def estimate_count(queryset):
+    """
+    Number of rows of a queryset, estimated from the database statistics
+    (PostgreSQL and MySQL) when the queryset isn't filtered, exact otherwise
+    """
+
+    estimate = None
+    if not queryset.query.where:
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+                estimate = (cursor.fetchone() or [None])[0]
+            elif connection.vendor == 'mysql':
+                cursor.execute(
+                    'SELECT table_rows FROM information_schema.tables '
+                    'WHERE table_schema = DATABASE() AND table_name = %s', [table]
+                )
+                estimate = (cursor.fetchone() or [None])[0]
+
+    if estimate is None or estimate < EXACT_COUNT_THRESHOLD:
+        # the annotations (JSON keys of the admin) aren't computed to count
+        queryset = queryset.all()
+        queryset.query.set_annotation_mask(())
+        return queryset.count()
+    return estimate
+
+# ==============================================================================================
+
+class LargeTablePaginator(Paginator):
+
+    """
+    Paginator for tables with millions of rows:
+    * the count is estimated, see estimate_count
+    * when the queryset is ordered by pk and the pk of the last row of the previous page
+      is given (after), the page is fetched with a keyset seek (pk < after LIMIT n) whatever
+      its depth, instead of an OFFSET. Pages reached without it (jumps) use an OFFSET
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, after=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.after = after
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+    @cached_property
+    def keyset_order(self):
+        """'pk' or '-pk' when the queryset is ordered by its primary key only, None otherwise"""
+        pk_name  = self.object_list.model._meta.pk.name
+        # the admin changelist repeats the pk as tie breaker
+        order_by = tuple(dict.fromkeys(
+            ('-pk' if field.startswith('-') else 'pk')
+            if isinstance(field, str) and field.lstrip('-') in (pk_name, 'pk') else field
+            for field in self.object_list.query.order_by
+        ))
+        return order_by[0] if order_by in (('-pk',), ('pk',)) else None
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.after is None or self.keyset_order is None:
+            return super().page(number)
+        lookup = 'pk__lt' if self.keyset_order == '-pk' else 'pk__gt'
+        return self._get_page(
+            list(self.object_list.filter(**{lookup: self.after})[:self.per_page]),
+            number,
+            self
+        )
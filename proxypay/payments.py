@@ -0,0 +1,191 @@
+###
+##  Django Proxypay Payments Reconciliation
+#
+
+import datetime
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy as _
+
+from . import dispatch, metrics, rollups
+from .api import api
+from .configs import conf
+from .exceptions import ProxypayException
+from .references import get, cache as reference_cache
+from .signals import reference_paid
+
+# ==========================================================================================================
+
+def get_key(payment):
+    """Reference uuid key of a payment, from its custom fields"""
+    return (payment.get('custom_fields') or {}).get(conf.REFERENCE_UUID_KEY)
+
+def match(payment, by_key, by_reference):
+    """
+    Reference of a payment, the same rules for the webhook (apply_payment) and reconcile:
+    * the reference of the payment uuid key, unless it was paid by another payment
+    * otherwise the waiting, not expired, reference of the payment reference id
+    by_key and by_reference are the lookups, key -> reference and reference id -> reference (or None)
+    """
+
+    if (key := get_key(payment)) and (reference := by_key(key)):
+        payment_id = (reference.payment or {}).get('id')
+        if reference.status == reference.Status.WAITING or (payment_id is not None and payment_id == payment.get('id')):
+            return reference
+    return by_reference(str(payment.get('reference_id'))) or None
+
+def apply_payment(payment):
+    """
+    Updates the reference related to a payment (from Proxypay's webhook) as paid.
+    Returns False if the payment reference is not found
+    """
+
+    reference = match(payment, lambda key: get(key), lambda reference_id: get(None, reference_id))
+    if reference:
+        reference.paid(payment)
+        return True
+    return False
+
+# ==========================================================================================================
+
+def reconcile(payments=None, concurrency: int = 10):
+    """
+    Recognizes all payments not yet acknowledged in Proxypay, with a single
+    download of the /payments backlog and a single query for the related references.
+
+    Matched references are updated as paid with one bulk_update, reference_paid is sent
+    for each of them, and the payments are acknowledged concurrently.
+    Unrecognized payments are only acknowledged if ACCEPT_UNRECOGNIZED_PAYMENT is set.
+
+    Returns a dict with the lists of payments: {'matched': [], 'unmatched': [], 'failed': []},
+    failed being the payments that couldn't be acknowledged
+    """
+
+    from .models import Reference, ProcessedPayment
+
+    if payments is None:
+        payments = api.get_payments()
+        if payments is False:
+            raise ProxypayException(_('Error getting payments from Proxypay'))
+
+    summary = {'matched': [], 'unmatched': [], 'failed': []}
+    if not payments:
+        return summary
+
+    # indexing payments by reference uuid key and reference id
+    keys, reference_ids = set(), set()
+    for payment in payments:
+        if (key := get_key(payment)):
+            keys.add(key)
+        reference_ids.add(str(payment.get('reference_id')))
+
+    with transaction.atomic():
+        # references are locked before processed payments are written, like in Reference.paid
+        references = Reference.objects.select_for_update().filter(
+            Q(key__in=keys) | Q(reference__in=reference_ids)
+        ).order_by('pk')
+        by_key, by_reference, by_payment = {}, {}, {}
+        current = now()
+        for reference in references:
+            if reference.key:
+                by_key[reference.key] = reference
+            if reference.status == Reference.Status.WAITING:
+                if reference.expires_in and reference.expires_in > current:
+                    # like Reference.objects.get_reference, the first one
+                    by_reference.setdefault(reference.reference, reference)
+            elif reference.payment:
+                by_payment[reference.payment.get('id')] = reference
+
+        processed = set(ProcessedPayment.objects.filter(
+            payment_id__in=[payment.get('id') for payment in payments if payment.get('id') is not None]
+        ).values_list('payment_id', flat=True))
+
+        paid, processing = [], []
+        for payment in payments:
+            reference = match(payment, by_key.get, by_reference.get)
+            if str(payment.get('id')) in processed or payment.get('id') in by_payment:
+                # already applied, but not acknowledged
+                summary['matched'].append(payment)
+            elif reference and reference.status == Reference.Status.WAITING:
+                reference.set_payment(payment)
+                reference.updated_at = now()
+                if by_reference.get(reference.reference) is reference:
+                    by_reference.pop(reference.reference)
+                paid.append(reference)
+                if payment.get('id') is not None:
+                    processing.append(ProcessedPayment(payment_id=payment.get('id'), reference=reference))
+                summary['matched'].append(payment)
+            else:
+                summary['unmatched'].append(payment)
+
+        Reference.objects.bulk_update(paid, ['payment', 'status', 'paid_at', 'updated_at'])
+        ProcessedPayment.objects.bulk_create(processing, ignore_conflicts=True)
+        rollups.record(paid)
+    reference_cache.invalidate(paid)
+
+    # Dispatching Signals
+    dispatch.send_many(reference_paid, Reference, ({'reference': reference} for reference in paid))
+
+    # acknowledging payments
+    to_acknowledge = summary['matched'] + (summary['unmatched'] if conf.ACCEPT_UNRECOGNIZED_PAYMENT else [])
+
+    def acknowledge(payment):
+        try:
+            return api.acknowledge_payment(payment.get('id'))
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for payment, acknowledged in zip(to_acknowledge, executor.map(acknowledge, to_acknowledge)):
+            if not acknowledged:
+                summary['failed'].append(payment)
+
+    return summary
+
+# ==========================================================================================================
+
+def get_inbox_backoff(attempts):
+    """Seconds before retrying an inbox payment that failed <attempts> times"""
+    return min(conf.WEBHOOK_INBOX_RETRY_MAX_BACKOFF, conf.WEBHOOK_INBOX_RETRY_BACKOFF * 2 ** (attempts - 1))
+
+def drain_inbox(batch_size: int = 100):
+    """
+    Applies a batch of payments received in inbox mode. Rows are locked with
+    skip_locked, so several workers can drain the inbox in parallel. A payment
+    that fails is retried after an exponential backoff (see get_inbox_backoff).
+    Returns the number of inbox payments handled
+    """
+
+    from .models import InboxPayment
+
+    with transaction.atomic():
+        current = now()
+        entries = list(
+            InboxPayment.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True)
+            .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=current))
+            .order_by('id')[:batch_size]
+        )
+        for entry in entries:
+            entry.attempts += 1
+            try:
+                with transaction.atomic():
+                    recognized = apply_payment(json.loads(entry.payload))
+                entry.error = '' if recognized else 'unrecognized payment'
+                entry.processed_at = now()
+                metrics.webhook('processed' if recognized else 'unrecognized', source='inbox')
+            except Exception as e:
+                entry.error = repr(e)
+                metrics.webhook('failed', source='inbox')
+                if entry.attempts >= conf.WEBHOOK_INBOX_MAX_ATTEMPTS:
+                    # giving up
+                    entry.processed_at = now()
+                else:
+                    entry.retry_at = current + datetime.timedelta(seconds=get_inbox_backoff(entry.attempts))
+        InboxPayment.objects.bulk_update(entries, ['attempts', 'error', 'processed_at', 'retry_at'])
+
+    return len(entries)
@@ -0,0 +1,119 @@
+###
+##  Django Proxypay Rate Limiter
+#
+#   Client side rate limit of the Proxypay API calls, shared by all processes through Django's
+#   cache (use a shared cache with an atomic incr like redis or memcached, locmem limits each process alone).
+#   Limits are set by endpoint class with PROXYPAY['RATE_LIMIT'], as (requests per second, burst):
+#   {'reference_ids': (10, 20), 'references': (20, 40), 'payments': (5, 5)}
+#   A call over the limit waits for its turn (policy 'wait', up to RATE_LIMIT_MAX_WAIT seconds)
+#   or raises ProxypayRateLimited (policy 'fail')
+
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+
+from . import deadlines, metrics
+from .configs import conf
+from .exceptions import ProxypayRateLimited
+
+# ==========================================================================================================
+
+PREFIX      = 'proxypay:ratelimit'
+
+WAIT_POLICY = 'wait'
+FAIL_POLICY = 'fail'
+
+def get_endpoint_class(path):
+    """Endpoint class of a path: reference_ids, references, payments or None"""
+    name = path.lstrip('/').split('/', 1)[0].split('?', 1)[0]
+    return name if name in ('reference_ids', 'references', 'payments') else None
+
+# ==========================================================================================================
+
+class TokenBucket:
+
+    """
+    <burst> calls every <burst / rate> seconds, <rate> calls per second on average.
+    Calls are counted by window in the cache with add and incr, atomic in redis and memcached:
+    no lock, every call gets its own slot. A call finding its window full takes a slot in the
+    next one and waits for its start
+    """
+
+    def __init__(self, name, rate, burst=None, cache=None):
+        self.name   = name
+        self.burst  = max(int(burst or 1), 1)
+        self.window = self.burst / rate
+        self.cache  = cache or caches[conf.RATE_LIMIT_CACHE_ALIAS]
+        self.key    = f"{PREFIX}:{self.name}"
+
+    def take(self, index):
+        """Takes a slot of the window <index>, returns False if it is full"""
+        key = f"{self.key}:{self.window}:{index}"
+        for attempt in range(2):
+            self.cache.add(key, 0, int(self.window) + 60)
+            try:
+                return self.cache.incr(key) <= self.burst
+            except ValueError:
+                # expired or evicted between add and incr, once
+                if attempt:
+                    raise
+
+    def reserve(self, max_wait=0):
+        """
+        Takes a slot, returns the seconds to wait before using it (0 if available now).
+        Raises ProxypayRateLimited if the first free slot is available only after max_wait seconds
+        """
+
+        current = time.time()
+        index   = int(current / self.window)
+        while True:
+            wait = max(index * self.window - current, 0)
+            if wait > max_wait:
+                raise ProxypayRateLimited(
+                    _("Proxypay rate limit for '%(name)s', next call in %(wait).3fs") % {'name': self.name, 'wait': wait}
+                )
+            if self.take(index):
+                return wait
+            index += 1
+
+# ==========================================================================================================
+
+def get_bucket(path):
+    """Token bucket of the endpoint class of a path, None if it isn't limited"""
+    if not conf.RATE_LIMIT or not (name := get_endpoint_class(path)) or not (limit := conf.RATE_LIMIT.get(name)):
+        return None
+    rate, burst = limit if isinstance(limit, (tuple, list)) else (limit, limit)
+    return TokenBucket(name, rate, burst)
+
+def reserve(path):
+    """Takes a token for a call to path, returns the seconds to wait, see TokenBucket.reserve"""
+
+    if not (bucket := get_bucket(path)):
+        return 0
+    max_wait = conf.RATE_LIMIT_MAX_WAIT if conf.RATE_LIMIT_POLICY == WAIT_POLICY else 0
+    if (left := deadlines.remaining()) is not None:
+        # no waiting past the deadline
+        max_wait = max(min(max_wait, left), 0)
+    try:
+        wait = bucket.reserve(max_wait)
+    except ProxypayRateLimited:
+        metrics.increment('proxypay_rate_limited_total', {'endpoint_class': bucket.name})
+        raise
+    except Exception:
+        # cache errors, not blocking Proxypay calls
+        return 0
+    metrics.observe('proxypay_rate_limit_wait_seconds', wait, {'endpoint_class': bucket.name})
+    return wait
+
+def acquire(path):
+    """Waits for the rate limit of a call to path"""
+    if (wait := reserve(path)):
+        time.sleep(wait)
+
+async def aacquire(path):
+    """Async version of acquire"""
+    if conf.RATE_LIMIT and (wait := await sync_to_async(reserve)(path)):
+        await asyncio.sleep(wait)
@@ -1,2 +1,4 @@
-from proxypay.references.create import create
-from proxypay.references.get import get
\ No newline at end of file
+from proxypay.references.create import create, acreate, create_many
+from proxypay.references.get import get, aget
+from proxypay.references.renew import renew
+from proxypay.references.purge import purge
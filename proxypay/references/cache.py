@@ -0,0 +1,97 @@
+###
+##  Django Proxypay Reference Cache
+#
+#   Read-through cache of proxypay.models.Reference lookups, on top of Django's cache framework.
+#   References are cached by uuid key and by reference id, misses are cached for a shorter time.
+#   Enabled with PROXYPAY['REFERENCE_CACHE'], entries are invalidated when a reference is
+#   created, paid, updated, renewed or deleted by django proxypay, once the transaction commits
+
+import threading
+
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.timezone import now
+
+from proxypay import metrics
+from proxypay.configs import conf
+
+# ==========================================================================================================
+
+PREFIX    = 'proxypay:reference'
+NOT_FOUND = '__proxypay_not_found__'
+
+_stats      = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+
+def count(name):
+    with _stats_lock:
+        _stats[name] += 1
+    metrics.increment('proxypay_reference_cache_total', {'result': name})
+
+def stats():
+    """Hit and miss counters of this process, {'hits': int, 'misses': int}"""
+    with _stats_lock:
+        return dict(_stats)
+
+def reset_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+# ==========================================================================================================
+
+def get_cache():
+    return caches[conf.REFERENCE_CACHE_ALIAS]
+
+def get_cache_key(field, value):
+    return f"{PREFIX}:{field}:{value}"
+
+def get_timeout(reference):
+    """Waiting references are cached until they expire at most, since expired ones aren't looked up by id"""
+    timeout = conf.REFERENCE_CACHE_TIMEOUT
+    if reference.status == reference.Status.WAITING and reference.expires_in:
+        timeout = min(timeout, (reference.expires_in - now()).total_seconds())
+    return timeout
+
+def fetch(field, value, lookup):
+    """
+    Returns the cached reference for field (key or reference) and value,
+    calling lookup() and caching its result (or the miss) if it's not cached
+    """
+
+    cache     = get_cache()
+    cache_key = get_cache_key(field, value)
+    cached    = cache.get(cache_key)
+    if cached is not None:
+        count('hits')
+        return None if cached == NOT_FOUND else cached
+
+    count('misses')
+    reference = lookup()
+    if reference is None:
+        cache.set(cache_key, NOT_FOUND, conf.REFERENCE_CACHE_NEGATIVE_TIMEOUT)
+    elif (timeout := get_timeout(reference)) > 0:
+        cache.set(cache_key, reference, timeout)
+    return reference
+
+def invalidate(references, using=None):
+    """
+    Removes the cached entries (and misses) of the references, instances or dicts with key and reference.
+    Done when the current transaction commits (right away without transaction), since a lookup made
+    before the commit reads the old row and caches it again
+    """
+
+    if not conf.REFERENCE_CACHE:
+        return
+    cache_keys = []
+    for reference in references:
+        if isinstance(reference, dict):
+            key, reference_id = reference.get('key'), reference.get('reference')
+        else:
+            key, reference_id = reference.key, reference.reference
+        if key:
+            cache_keys.append(get_cache_key('key', key))
+        if reference_id:
+            cache_keys.append(get_cache_key('reference', reference_id))
+    if cache_keys:
+        transaction.on_commit(lambda: get_cache().delete_many(cache_keys), using=using)
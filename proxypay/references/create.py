@@ -1,59 +1,195 @@
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from proxypay.api import api
+from asgiref.sync import sync_to_async
+from django.utils.translation import gettext_lazy as _
+
+from proxypay import deadlines, dispatch
+from proxypay.api import api, async_api
 from proxypay.configs import conf
-from proxypay.utils import (
-    get_validated_data_for_reference_creation,
-    get_calculated_fees
-)
+from proxypay.references import pool, cache
+from proxypay.exceptions import ProxypayException
+from proxypay.signals import reference_created, references_created
+from proxypay.fees import get_fee_schedule, get_fee_values, to_json
+from proxypay.utils import get_validated_data_for_reference_creation
 
 # ==========================================================================
- 
-def create(amount: float, fields: dict = {}, days: int =None):
+
+def get_reference_creation_data(amount: float, fields: dict = {}, days: int = None):
+    """
+    Returns the data needed to create a reference, a tuple with:
+    the proxypay api data, and the proxypay.models.Reference field values
+    (uuid key, amount, fields, expiration datetime, additional data and fees)
+    """
+
+    fields      = dict(fields)
+    djpp_id     = uuid.uuid4().hex
+    data        = get_validated_data_for_reference_creation(amount, fields, days)
+    data['custom_fields'][conf.REFERENCE_UUID_KEY] = djpp_id
+    datetime    = data.pop('datetime')
+    fees        = get_fee_schedule().compute(amount)
+    return data, {
+        'key': djpp_id,
+        'amount': amount,
+        'fields': data['custom_fields'],
+        # reference additional data
+        'data': {name: to_json(fee) for name, fee in fees.items()},
+        # By default, proxypay references expire at the end of each day
+        'expires_in': datetime.replace(hour=23,minute=59,second=59),
+        **get_fee_values(amount, fees)
+    }
+
+# ==========================================================================
+
+def create(amount: float, fields: dict = {}, days: int =None, deadline: float = None):
     """
     Request to proxypay to create a reference and
-    returns an instance of proxypay.models.Reference
+    returns an instance of proxypay.models.Reference.
+    deadline limits the seconds spent in the Proxypay calls, see proxypay.deadlines
     """
 
     from proxypay.models import Reference
-    tryTimes = 3
-
-    while tryTimes > 0:
-        tryTimes -= 1
-        # Get Generated reference id from proxypay
-        referenceId = api.get_reference_id()
-        if not Reference.objects.is_available(referenceId):
-            continue
-        # custom field reference data
-        djpp_id     = uuid.uuid4().hex
-        data        = get_validated_data_for_reference_creation(amount, fields, days)
-        data['custom_fields'][conf.REFERENCE_UUID_KEY] = djpp_id
-        datetime    = data.pop('datetime')
-        # reference additional data
-        additional_data = {
-            'proxypay_fee': get_calculated_fees(
-                fee=conf.PROXYPAY_FEE[1:],
-                name=conf.PROXYPAY_FEE[0],
-                amount=amount
-            ),
-            'bank_fee': get_calculated_fees(
-                fee=conf.BANK_FEE[1:],
-                name=conf.BANK_FEE[0],
-                amount=amount
+    with deadlines.deadline(deadline):
+        tryTimes = 3
+
+        while tryTimes > 0:
+            tryTimes -= 1
+            # Get a reserved reference id, or a generated one from proxypay
+            referenceId = (conf.REFERENCE_ID_POOL and pool.take()) or api.get_reference_id()
+            if not Reference.objects.is_available(referenceId):
+                continue
+            data, values = get_reference_creation_data(amount, fields, days)
+            # trying to create the reference
+            if api.create_or_update_reference(referenceId, data):
+                # saving to the database
+                return Reference.objects.create(
+                    reference=referenceId,
+                    entity=api.entity,
+                    **values
+                )
+            break
+        return False
+
+# ==========================================================================
+
+async def acreate(amount: float, fields: dict = {}, days: int =None, deadline: float = None):
+    """
+    Async version of create, Proxypay requests are made with
+    proxypay.api.async_api and database queries in a thread
+    """
+
+    from proxypay.models import Reference
+    with deadlines.deadline(deadline):
+        tryTimes = 3
+
+        while tryTimes > 0:
+            tryTimes -= 1
+            # Get a reserved reference id, or a generated one from proxypay
+            referenceId = (
+                (conf.REFERENCE_ID_POOL and await sync_to_async(pool.take)())
+                or await async_api.get_reference_id()
             )
-        }
-        # trying to create the reference
-        if api.create_or_update_reference(referenceId, data):
-            # saving to the database
-            return Reference.objects.create(
-                key=djpp_id,
-                reference=referenceId,
-                amount=amount,
-                entity=api.entity,
-                fields=fields,
-                data=additional_data,
-                # By default, proxypay references expire at the end of each day
-                expires_in=datetime.replace(hour=23,minute=59,second=59)
+            if not await sync_to_async(Reference.objects.is_available)(referenceId):
+                continue
+            data, values = get_reference_creation_data(amount, fields, days)
+            # trying to create the reference
+            if await async_api.create_or_update_reference(referenceId, data):
+                # saving to the database
+                return await sync_to_async(Reference.objects.create)(
+                    reference=referenceId,
+                    entity=async_api.entity,
+                    **values
+                )
+            break
+        return False
+
+# ==========================================================================
+
+def create_many(items, concurrency: int = 10):
+    """
+    Creates many references at once. items is a list of dicts with the
+    create arguments (amount, fields, days), like: [{'amount': 3500}, ...]
+
+    Reference ids are requested and references created in Proxypay concurrently,
+    using at most <concurrency> simultaneous requests, then all references are
+    saved with a single bulk_create. Keep concurrency under PROXYPAY['API_POOL_SIZE']
+    so every request reuses a pooled connection.
+    Returns a tuple (references, failures), where failures is a list of (item, error)
+    """
+
+    from proxypay.models import Reference
+
+    items    = list(items)
+    failures = []
+    created  = []
+    pending  = list(range(len(items)))
+    errors   = {}
+
+    def call(func, *args):
+        try:
+            return func(*args), None
+        except Exception as e:
+            return None, e
+
+    def put(args):
+        index, referenceId = args
+        item = items[index]
+        data, values = get_reference_creation_data(
+            item['amount'], item.get('fields', {}), item.get('days')
+        )
+        if not api.create_or_update_reference(referenceId, data):
+            raise ProxypayException(_('Error creating the reference in Proxypay'))
+        return Reference(
+            reference=referenceId,
+            entity=api.entity,
+            **values
+        )
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        tryTimes = 3
+        while pending and tryTimes > 0:
+            tryTimes -= 1
+            # Get Generated reference ids from proxypay
+            referenceIds = list(executor.map(lambda index: call(api.get_reference_id), pending))
+            available = Reference.objects.available(
+                referenceId for referenceId, error in referenceIds if not error
             )
-        break
-    return False
+            to_create, retry = [], []
+            for index, (referenceId, error) in zip(pending, referenceIds):
+                if error or not referenceId:
+                    errors[index] = error or ProxypayException(_('Error getting a reference id from Proxypay'))
+                    retry.append(index)
+                elif str(referenceId) in available:
+                    # avoid giving the same id to two items
+                    available.discard(str(referenceId))
+                    to_create.append((index, referenceId))
+                else:
+                    errors[index] = ProxypayException(_('Reference id %s is not available') % referenceId)
+                    retry.append(index)
+            # trying to create the references
+            for (index, _referenceId), (reference, error) in zip(
+                to_create, executor.map(lambda args: call(put, args), to_create)
+            ):
+                if error:
+                    failures.append((items[index], error))
+                else:
+                    created.append((index, reference))
+            pending = retry
+
+    failures.extend((items[index], errors[index]) for index in pending)
+    if not created:
+        return [], failures
+
+    # saving to the database
+    created.sort(key=lambda result: result[0])
+    references = Reference.objects.bulk_create(reference for _index, reference in created)
+    if any(reference.pk is None for reference in references):
+        # some backends do not return the primary keys from bulk inserts
+        saved = Reference.objects.in_bulk([reference.key for reference in references], field_name='key')
+        references = [saved[reference.key] for reference in references]
+    # cached misses
+    cache.invalidate(references)
+    # Dispatching Signals
+    dispatch.send_many(reference_created, Reference, ({'reference': reference} for reference in references))
+    dispatch.send(references_created, Reference, references=references)
+    return references, failures
@@ -2,22 +2,49 @@
 ##  Django Proxypay Get Reference
 #
 
+from asgiref.sync import sync_to_async
+
+from proxypay.configs import conf
+from proxypay.references import cache
+
 # ==========================================================================================================
  
 def get (key, reference_id=False):
 
     """
     Get a payment reference instance from proxypay.models.Reference
-    Returns false if the passed id reference is not found
+    Returns false if the passed id reference is not found.
+    With PROXYPAY['REFERENCE_CACHE'] enabled, lookups are read through the cache
     """
 
     from proxypay.models import Reference
 
-    try:
-        return Reference.objects.get(key=key)
-    except:
-        if reference_id:
-            return Reference.objects.get_reference(
-                reference=reference_id
-            )
-        return False
\ No newline at end of file
+    def get_by_key():
+        try:
+            return Reference.objects.get(key=key)
+        except Reference.DoesNotExist:
+            return None
+
+    def get_by_reference():
+        return Reference.objects.get_reference(reference=reference_id)
+
+    if conf.REFERENCE_CACHE:
+        reference = cache.fetch('key', key, get_by_key) if key else None
+        if not reference and reference_id:
+            return cache.fetch('reference', reference_id, get_by_reference)
+        return reference or False
+
+    reference = get_by_key() if key else None
+    if not reference and reference_id:
+        return get_by_reference()
+    return reference or False
+
+# ==========================================================================================================
+
+async def aget (key, reference_id=False):
+
+    """
+    Async version of get
+    """
+
+    return await sync_to_async(get)(key, reference_id)
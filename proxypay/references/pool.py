@@ -0,0 +1,121 @@
+###
+##  Django Proxypay Reference Id Pool
+#
+#   Reference ids reserved from Proxypay ahead of time, so creating a reference
+#   doesn't have to wait for the /reference_ids round trip. The pool is kept in
+#   the database (proxypay.models.ReferenceId) and shared by all worker processes.
+#   Refills are serialized across processes with a lock in the REFERENCE_ID_POOL_CACHE_ALIAS
+#   cache (use a shared cache, redis or memcached), so workers crossing the low watermark
+#   together don't each reserve a full pool
+
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.cache import caches
+from django.db import connection
+
+from proxypay.api import api
+from proxypay.configs import conf
+
+# ==========================================================================================================
+
+_refilling = threading.Lock()
+
+LOCK_KEY = 'proxypay:reference_id_pool:refill'
+# seconds after which the lock of a refill that died (killed worker) is released
+LOCK_TIMEOUT = 120
+
+# ==========================================================================================================
+
+def take():
+    """
+    Takes a reserved reference id from the pool.
+    Returns None if the pool is empty
+    """
+
+    from proxypay.models import ReferenceId
+
+    reference = None
+    while reference is None:
+        candidates = list(ReferenceId.objects.order_by('id').values_list('id', 'reference')[:10])
+        if not candidates:
+            break
+        # spreading concurrent workers over different rows
+        random.shuffle(candidates)
+        for pk, candidate in candidates:
+            # only one worker can delete the row, the one that claims the id
+            if ReferenceId.objects.filter(pk=pk).delete()[0]:
+                reference = candidate
+                break
+
+    if ReferenceId.objects.count() < conf.REFERENCE_ID_POOL_LOW_WATERMARK:
+        refill_in_background()
+    return reference
+
+def refill(size=None):
+    """
+    Reserves reference ids from Proxypay until the pool has <size> ids,
+    by default the high watermark. Returns the number of ids added,
+    0 if the pool is already being refilled by another process
+    """
+
+    from proxypay.models import ReferenceId
+
+    if (size or conf.REFERENCE_ID_POOL_HIGH_WATERMARK) - ReferenceId.objects.count() <= 0:
+        return 0
+
+    cache = caches[conf.REFERENCE_ID_POOL_CACHE_ALIAS]
+    token = uuid.uuid4().hex
+    if not cache.add(LOCK_KEY, token, LOCK_TIMEOUT):
+        return 0
+    try:
+        # counted again, the pool may have been refilled while taking the lock
+        return fill((size or conf.REFERENCE_ID_POOL_HIGH_WATERMARK) - ReferenceId.objects.count())
+    finally:
+        # not released if it expired and was taken by another refill
+        if cache.get(LOCK_KEY) == token:
+            cache.delete(LOCK_KEY)
+
+def fill(needed):
+    """Reserves <needed> reference ids from Proxypay and adds the available ones to the pool"""
+
+    from proxypay.models import Reference, ReferenceId
+
+    if needed <= 0:
+        return 0
+
+    def get_reference_id(_):
+        try:
+            return api.get_reference_id()
+        except Exception:
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(needed, conf.API_POOL_SIZE)) as executor:
+        references = [reference for reference in executor.map(get_reference_id, range(needed)) if reference]
+
+    available = Reference.objects.available(references)
+    ReferenceId.objects.bulk_create(
+        (ReferenceId(reference=reference) for reference in available),
+        ignore_conflicts=True
+    )
+    return len(available)
+
+def refill_in_background():
+    """
+    Refills the pool in a daemon thread, if it is not already being refilled by this process
+    """
+
+    if not _refilling.acquire(blocking=False):
+        return False
+
+    def run():
+        try:
+            refill()
+        finally:
+            connection.close()
+            _refilling.release()
+
+    threading.Thread(target=run, name='proxypay-reference-id-pool', daemon=True).start()
+    return True
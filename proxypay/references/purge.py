@@ -0,0 +1,61 @@
+###
+##  Django Proxypay Bulk Reference Purge
+#
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.utils.timezone import now
+
+from proxypay.api import api
+from proxypay.references import cache
+
+# ==========================================================================================================
+ 
+def purge(queryset, concurrency: int = 10, chunk_size: int = 1000, start_after: int = 0, on_chunk=None):
+
+    """
+    Deletes many references in Proxypay, with at most <concurrency> simultaneous requests,
+    and then from the database, one delete query by chunk of <chunk_size> references.
+
+    References are handled in primary key order, from the first pk after <start_after>.
+    on_chunk(last_pk, deleted) is called after each chunk, to keep a checkpoint and resume later.
+    A reference whose reference id is in use by another waiting reference is only deleted from the database.
+    Returns a tuple (deleted, failures), the number of deleted references and the list of failed ones
+    """
+
+    from proxypay.models import Reference
+
+    def delete(reference_id):
+        try:
+            # already deleted or expired in Proxypay, is fine
+            return api.delete(f"/references/{reference_id}").status_code in (204, 404)
+        except Exception:
+            return False
+
+    deleted, failures, last_pk = 0, [], start_after or 0
+    queryset = queryset.order_by('pk').only('pk', 'key', 'reference')
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while (references := list(queryset.filter(pk__gt=last_pk)[:chunk_size])):
+            last_pk = references[-1].pk
+            # reference ids taken by other references, deleting them in Proxypay would delete the other ones
+            in_use = set(Reference.objects.filter(
+                reference__in=[reference.reference for reference in references],
+                status=Reference.Status.WAITING,
+                expires_in__gt=now()
+            ).exclude(pk__in=[reference.pk for reference in references]).values_list('reference', flat=True))
+            to_delete = [reference for reference in references if reference.reference not in in_use]
+
+            done = [reference for reference in references if reference.reference in in_use]
+            for reference, ok in zip(to_delete, executor.map(delete, [r.reference for r in to_delete])):
+                if ok:
+                    done.append(reference)
+                else:
+                    failures.append(reference)
+            Reference.objects.filter(pk__in=[reference.pk for reference in done]).delete()
+            cache.invalidate(done)
+            deleted += len(done)
+
+            if on_chunk:
+                on_chunk(last_pk, deleted)
+
+    return deleted, failures
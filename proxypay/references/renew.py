@@ -0,0 +1,62 @@
+###
+##  Django Proxypay Bulk Reference Renewal
+#
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.utils.timezone import now
+
+from proxypay.api import api
+from proxypay.references import cache
+from proxypay.utils import get_validated_data_for_reference_creation
+
+# ==========================================================================================================
+ 
+def renew(queryset, days: int = None, concurrency: int = 10, chunk_size: int = 1000):
+
+    """
+    Renews (updates the expiration of) many references in Proxypay, like Reference.update,
+    with at most <concurrency> simultaneous requests. References are read <chunk_size> at a time
+    and the new expirations saved with one bulk_update by chunk.
+    A reference whose reference id is in use by another waiting reference is not renewed.
+    Returns a tuple (renewed, failures), the number of renewed references and the list of failed ones
+    """
+
+    from proxypay.models import Reference
+
+    def put(reference):
+        try:
+            data     = get_validated_data_for_reference_creation(float(reference.amount), reference.fields, days)
+            datetime = data.pop('datetime')
+            if api.create_or_update_reference(reference.reference, data=data):
+                reference.expires_in = datetime.replace(hour=23,minute=59,second=59)
+                return True
+        except Exception:
+            pass
+        return False
+
+    renewed, failures, last_pk = 0, [], 0
+    queryset = queryset.order_by('pk').only('pk', 'key', 'reference', 'amount', 'fields', 'expires_in')
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while (references := list(queryset.filter(pk__gt=last_pk)[:chunk_size])):
+            last_pk = references[-1].pk
+            # reference ids taken by other references since these expired
+            in_use = set(Reference.objects.filter(
+                reference__in=[reference.reference for reference in references],
+                status=Reference.Status.WAITING,
+                expires_in__gt=now()
+            ).exclude(pk__in=[reference.pk for reference in references]).values_list('reference', flat=True))
+            references = [reference for reference in references if reference.reference not in in_use]
+
+            done = []
+            for reference, ok in zip(references, executor.map(put, references)):
+                if ok:
+                    reference.updated_at = now()
+                    done.append(reference)
+                else:
+                    failures.append(reference)
+            Reference.objects.bulk_update(done, ['expires_in', 'updated_at'])
+            cache.invalidate(done)
+            renewed += len(done)
+
+    return renewed, failures
@@ -0,0 +1,34 @@
+###
+##  Django Proxypay Retries
+#
+#   Idempotent Proxypay calls (GET, PUT, DELETE) are retried PROXYPAY['API_RETRIES'] times on
+#   connection errors, timeouts, 5xx and 429 responses, with exponential backoff and full jitter:
+#   a random delay between 0 and min(API_RETRY_MAX_BACKOFF, API_RETRY_BACKOFF * 2 ** attempt),
+#   or the Retry-After of the response when Proxypay sends one
+
+import random
+
+from .configs import conf
+
+# ==========================================================================================================
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+def get_attempts(method):
+    """Number of attempts of a call, 1 for the non idempotent ones"""
+    return 1 + (max(int(conf.API_RETRIES or 0), 0) if method in IDEMPOTENT_METHODS else 0)
+
+def should_retry(response):
+    return response.status_code in RETRY_STATUS_CODES
+
+def get_backoff(attempt, response=None):
+    """Seconds to wait before retrying after the attempt (from 0)"""
+    cap = conf.API_RETRY_MAX_BACKOFF
+    if response is not None and (retry_after := response.headers.get('Retry-After')):
+        try:
+            return min(max(float(retry_after), 0), cap)
+        except ValueError:
+            # http date, not used by Proxypay
+            pass
+    return random.uniform(0, min(cap, conf.API_RETRY_BACKOFF * 2 ** attempt))
@@ -0,0 +1,119 @@
+###
+##  Django Proxypay Revenue Rollups
+#
+#   proxypay.models.DailyRevenue keeps the totals of paid references by day and entity,
+#   so reports read a few rows instead of aggregating the whole references table
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F, Max, Min, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .fees import to_decimal
+
+# ==============================================================================================
+
+def get_day(reference):
+    """Day of the payment of a reference, in the current timezone"""
+    paid_at = reference.paid_at or reference.updated_at or timezone.now()
+    return timezone.localdate(paid_at) if timezone.is_aware(paid_at) else paid_at.date()
+
+def get_totals():
+    return defaultdict(lambda: {
+        'paid_count': 0,
+        'amount': Decimal('0.00'),
+        'fees_expense': Decimal('0.00'),
+        'net_amount': Decimal('0.00')
+    })
+
+# ==============================================================================================
+
+def record(references):
+    """
+    Adds paid references to the rollup, with one update (or insert) by day and entity.
+    Run it in the same transaction that updates the references as paid
+    """
+
+    from .models import DailyRevenue
+
+    totals = get_totals()
+    for reference in references:
+        total = totals[(get_day(reference), reference.entity or '')]
+        total['paid_count']   += 1
+        total['amount']       += to_decimal(reference.amount)
+        total['fees_expense'] += to_decimal(reference.fees_expense)
+        total['net_amount']   += to_decimal(reference.net_amount)
+
+    for (day, entity), total in totals.items():
+        increments = {name: F(name) + value for name, value in total.items()}
+        if DailyRevenue.objects.filter(day=day, entity=entity).update(**increments):
+            continue
+        try:
+            with transaction.atomic():
+                DailyRevenue.objects.create(day=day, entity=entity, **total)
+        except IntegrityError:
+            # created by a concurrent payment
+            DailyRevenue.objects.filter(day=day, entity=entity).update(**increments)
+
+# ==============================================================================================
+
+def lock(queryset):
+    """
+    Blocks the writes to the rollup table (record) until the end of the current transaction,
+    inserts included: with LOCK TABLE in PostgreSQL, with the next-key locks of a locking read
+    in MySQL. SQLite has no row locks, the first write of the transaction locks the database
+    (a read before it would deadlock with a concurrent payment upgrading its own lock)
+    """
+
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {connection.ops.quote_name(queryset.model._meta.db_table)} IN EXCLUSIVE MODE")
+    elif connection.vendor != 'sqlite':
+        list(queryset.select_for_update().values_list('pk', flat=True))
+
+def rebuild(chunk_size: int = 10000):
+    """
+    Rebuilds the rollup from the references table, aggregating in the database
+    one primary key range of <chunk_size> references at a time.
+    The rollup is locked, emptied, aggregated and filled in one transaction: payments
+    wait for the rebuild to record their totals, and aren't lost or counted twice.
+    Returns the number of rollup rows
+    """
+
+    from .models import DailyRevenue, Reference
+
+    with transaction.atomic(using=DailyRevenue.objects.db):
+        lock(DailyRevenue.objects.all())
+        DailyRevenue.objects.all().delete()
+        totals = aggregate(Reference.objects.filter(status=Reference.Status.PAID), chunk_size)
+        DailyRevenue.objects.bulk_create(
+            DailyRevenue(day=day, entity=entity, **total) for (day, entity), total in totals.items()
+        )
+    return len(totals)
+
+def aggregate(paid, chunk_size):
+    """Totals of the paid references by day and entity, one primary key range at a time"""
+
+    totals = get_totals()
+    bounds = paid.aggregate(first=Min('pk'), last=Max('pk'))
+    start  = bounds['first']
+
+    while start is not None and start <= bounds['last']:
+        chunk = paid.filter(pk__gte=start, pk__lt=start + chunk_size).annotate(
+            day=TruncDate(Coalesce('paid_at', 'updated_at'))
+        ).values('day', 'entity').annotate(
+            chunk_paid_count=Count('pk'),
+            chunk_amount=Sum('amount'),
+            chunk_fees_expense=Sum('fees_expense'),
+            chunk_net_amount=Sum('net_amount')
+        ).order_by()
+        for row in chunk:
+            total = totals[(row['day'], row['entity'] or '')]
+            for name in total:
+                total[name] += row[f"chunk_{name}"] or 0
+        start += chunk_size
+    return totals
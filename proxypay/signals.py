@@ -1,4 +1,5 @@
 from django.dispatch import Signal
 
 reference_paid = Signal(['reference'])
-reference_created = Signal(['reference'])
\ No newline at end of file
+reference_created = Signal(['reference'])
+references_created = Signal(['references'])
\ No newline at end of file
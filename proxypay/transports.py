@@ -0,0 +1,394 @@
+###
+##  Django Proxypay Transports
+#
+#   HTTP backends under proxypay.api.ProxypayAPI, set with PROXYPAY['TRANSPORT']:
+#   'requests'  RequestsTransport, pooled requests session (default)
+#   'urllib3'   Urllib3Transport, pooled urllib3 PoolManager, the lightest
+#   'httpx'     HttpxTransport, pooled httpx client, HTTP/2 with PROXYPAY['API_HTTP2'] (needs httpx[http2])
+#   'fake'      FakeTransport, an in memory Proxypay, for tests and load tests without network
+#   or the dotted path of a Transport subclass. AsyncProxypayAPI uses AsyncHttpxTransport,
+#   or AsyncFakeTransport with the fake transport, see PROXYPAY['ASYNC_TRANSPORT']
+
+import itertools
+import json as jsonlib
+import os
+import re
+import threading
+import weakref
+from urllib.parse import urlencode, urlparse
+
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+from django.utils.translation import gettext_lazy as _
+
+from .exceptions import ProxypayException
+
+# ==========================================================================================================
+
+class Response:
+
+    """Response of the transports without a response class, with the requests/httpx attributes used"""
+
+    __slots__ = ('status_code', 'content', 'headers')
+
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content     = content or b''
+        self.headers     = headers or {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def json(self):
+        return jsonlib.loads(self.content)
+
+    def __repr__(self):
+        return f"<Response [{self.status_code}]>"
+
+# ==========================================================================================================
+
+class Transport:
+
+    """
+    Sends the Proxypay API requests. request returns an object with
+    status_code, content, text, headers and json(). errors are the exceptions
+    raised when a request fails without a response (connection errors, timeouts).
+    timeout is a number of seconds or a tuple (connect, read), the transport timeout by default
+    """
+
+    errors = ()
+
+    def __init__(self, base_url, headers, timeout=(5, 30), pool_size=10, **options):
+        self.base_url  = base_url
+        self.headers   = dict(headers)
+        self.timeout   = timeout
+        self.pool_size = pool_size
+        self.options   = options
+
+    def request(self, method, path, json=None, params=None, timeout=None):
+        raise NotImplementedError
+
+    def get_timeout(self, timeout=None):
+        """(connect, read) timeout tuple"""
+        timeout = timeout or self.timeout
+        return tuple(timeout) if isinstance(timeout, (tuple, list)) else (timeout, timeout)
+
+    def warm_up(self):
+        """Opens a connection ahead of the first request, returns False on errors"""
+        try:
+            self.request('HEAD', '')
+            return True
+        except self.errors:
+            return False
+
+    def close(self):
+        pass
+
+# ==========================================================================================================
+
+class RequestsTransport(Transport):
+
+    def __init__(self, *args, **kwargs):
+        # imported on demand, requests is heavy and not needed to load the app
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        super().__init__(*args, **kwargs)
+        self.errors = (requests.RequestException,)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session = requests.Session()
+        session.headers.update(self.headers)
+        session.headers['Connection'] = 'keep-alive'
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        # the environment (proxies, ca bundle) is read once, instead of on every request
+        session.trust_env = False
+        session.proxies   = requests.utils.get_environ_proxies(self.base_url)
+        session.verify    = os.environ.get('REQUESTS_CA_BUNDLE') or os.environ.get('CURL_CA_BUNDLE') or True
+        self.session = session
+
+    def request(self, method, path, json=None, params=None, timeout=None):
+        with self.session.request(
+            method, f"{self.base_url}{path}", json=json, params=params, timeout=self.get_timeout(timeout)
+        ) as r:
+            return r
+
+    def close(self):
+        self.session.close()
+
+# ==========================================================================================================
+
+class Urllib3Transport(Transport):
+
+    def __init__(self, *args, **kwargs):
+        import urllib3
+        from urllib.request import getproxies, proxy_bypass
+
+        super().__init__(*args, **kwargs)
+        self.errors = (urllib3.exceptions.HTTPError,)
+        connect_timeout, read_timeout = self.get_timeout()
+        options = dict(
+            maxsize=self.pool_size,
+            headers=self.headers,
+            timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout),
+            retries=False
+        )
+        url   = urlparse(self.base_url)
+        proxy = getproxies().get(url.scheme)
+        if proxy and not proxy_bypass(url.hostname):
+            self.pool = urllib3.ProxyManager(proxy, **options)
+        else:
+            self.pool = urllib3.PoolManager(**options)
+
+    def request(self, method, path, json=None, params=None, timeout=None):
+        import urllib3
+
+        url  = f"{self.base_url}{path}" + (f"?{urlencode(params)}" if params else '')
+        body = jsonlib.dumps(json).encode() if json is not None else None
+        if timeout:
+            connect_timeout, read_timeout = self.get_timeout(timeout)
+            timeout = urllib3.Timeout(connect=connect_timeout, read=read_timeout)
+        r = self.pool.request(method, url, body=body, **({'timeout': timeout} if timeout else {}))
+        return Response(r.status, r.data, dict(r.headers))
+
+    def close(self):
+        self.pool.clear()
+
+# ==========================================================================================================
+
+def import_httpx():
+    try:
+        import httpx
+    except ImportError:
+        raise ProxypayException(
+            _('The httpx transport requires httpx, install it with: pip install django-proxypay[async]')
+        )
+    return httpx
+
+def get_httpx_timeout(transport, timeout=None):
+    """timeout argument of a httpx request, the client timeout if not given"""
+    if not timeout:
+        return {}
+    connect_timeout, read_timeout = transport.get_timeout(timeout)
+    return {'timeout': import_httpx().Timeout(read_timeout, connect=connect_timeout)}
+
+class HttpxTransport(Transport):
+
+    def __init__(self, *args, **kwargs):
+        httpx = import_httpx()
+        super().__init__(*args, **kwargs)
+        self.errors = (httpx.TransportError,)
+        connect_timeout, read_timeout = self.get_timeout()
+        self.client = httpx.Client(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            http2=self.options.get('http2', False)
+        )
+
+    def request(self, method, path, json=None, params=None, timeout=None):
+        return self.client.request(method, path, json=json, params=params, **get_httpx_timeout(self, timeout))
+
+    def close(self):
+        self.client.close()
+
+class AsyncHttpxTransport(Transport):
+
+    """httpx transport for AsyncProxypayAPI, with one client per event loop (clients can't be shared between loops)"""
+
+    def __init__(self, *args, **kwargs):
+        httpx = import_httpx()
+        super().__init__(*args, **kwargs)
+        self.errors  = (httpx.TransportError,)
+        self.clients = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        """Pooled keep-alive httpx client bound to the running event loop"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if (client := self.clients.get(loop)) is None or client.is_closed:
+            client = self.clients[loop] = self.build_client()
+        return client
+
+    def build_client(self):
+        httpx = import_httpx()
+        connect_timeout, read_timeout = self.get_timeout()
+        return httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            http2=self.options.get('http2', False)
+        )
+
+    async def request(self, method, path, json=None, params=None, timeout=None):
+        return await self.client.request(method, path, json=json, params=params, **get_httpx_timeout(self, timeout))
+
+    async def warm_up(self):
+        try:
+            await self.request('HEAD', '')
+            return True
+        except self.errors:
+            return False
+
+    async def close(self):
+        """Closes the client bound to the running event loop"""
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if (client := self.clients.pop(loop, None)) is not None:
+            await client.aclose()
+
+# ==========================================================================================================
+
+class FakeProxypay:
+
+    """
+    In memory Proxypay: generates reference ids, keeps the references and the payments
+    not yet acknowledged. Payments are made with add_payment, or with the sandbox POST /payments.
+
+        from proxypay.transports import fake_proxypay
+        fake_proxypay.add_payment(reference.reference)
+        reference.check_payment()
+    """
+
+    # GET /payments returns at most this number of payments, like Proxypay
+    PAGE_SIZE = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.reference_ids = itertools.count(100000000)
+            self.payment_ids   = itertools.count(1)
+            self.references    = {}     # reference id: reference data
+            self.payments      = {}     # payment id: payment, not acknowledged
+            self.acknowledged  = {}     # payment id: payment
+
+    def add_payment(self, reference_id, amount=None, custom_fields=None):
+        """Pays a reference, amount and custom fields default to the reference ones. Returns the payment"""
+        with self.lock:
+            reference = self.references.get(str(reference_id)) or {}
+            payment   = {
+                'id': next(self.payment_ids),
+                'reference_id': str(reference_id),
+                'amount': str(amount if amount is not None else reference.get('amount', 0)),
+                'datetime': now().strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+                'entity_id': None,
+                'terminal_type': 'ATM',
+                'terminal_id': '0000000001',
+                'terminal_location': 'LUANDA',
+                'transaction_id': None,
+                'period_id': None,
+                'period_start_datetime': None,
+                'period_end_datetime': None,
+                'product_id': None,
+                'custom_fields': dict(custom_fields if custom_fields is not None else reference.get('custom_fields') or {})
+            }
+            self.payments[payment['id']] = payment
+            return payment
+
+    def handle(self, method, path, json=None, params=None):
+        """Returns a tuple (status code, json body or None)"""
+
+        if method == 'POST' and path == '/reference_ids':
+            with self.lock:
+                return 200, str(next(self.reference_ids))
+
+        if (match := re.fullmatch(r'/references/(\d+)', path)):
+            with self.lock:
+                if method == 'PUT':
+                    if not isinstance(json, dict) or 'amount' not in json:
+                        return 400, None
+                    self.references[match.group(1)] = json
+                    return 204, None
+                if method == 'DELETE':
+                    return (204 if self.references.pop(match.group(1), None) is not None else 404), None
+
+        if path == '/payments':
+            if method == 'GET':
+                size = int((params or {}).get('n', self.PAGE_SIZE))
+                with self.lock:
+                    return 200, list(itertools.islice(self.payments.values(), size))
+            if method == 'POST':
+                return 200, self.add_payment(json['reference_id'], json.get('amount'))
+
+        if method == 'DELETE' and (match := re.fullmatch(r'/payments/(\d+)', path)):
+            with self.lock:
+                if (payment := self.payments.pop(int(match.group(1)), None)) is not None:
+                    self.acknowledged[payment['id']] = payment
+            return 204, None
+
+        if method in ('HEAD', 'GET') and path in ('', '/'):
+            return 200, None
+        return 404, None
+
+# shared by the sync and async fake transports
+fake_proxypay = FakeProxypay()
+
+class FakeTransport(Transport):
+
+    """Transport to an in memory Proxypay, fake_proxypay by default"""
+
+    def __init__(self, *args, proxypay=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.proxypay = proxypay or fake_proxypay
+
+    def request(self, method, path, json=None, params=None, timeout=None):
+        status, body = self.proxypay.handle(method, path, json=json, params=params)
+        content = jsonlib.dumps(body).encode() if body is not None else b''
+        return Response(status, content, {'Content-Type': 'application/json'})
+
+class AsyncFakeTransport(FakeTransport):
+
+    async def request(self, method, path, json=None, params=None, timeout=None):
+        return super().request(method, path, json=json, params=params, timeout=timeout)
+
+    async def warm_up(self):
+        return True
+
+    async def close(self):
+        pass
+
+# ==========================================================================================================
+
+TRANSPORTS = {
+    'requests': 'proxypay.transports.RequestsTransport',
+    'urllib3': 'proxypay.transports.Urllib3Transport',
+    'httpx': 'proxypay.transports.HttpxTransport',
+    'fake': 'proxypay.transports.FakeTransport',
+}
+
+ASYNC_TRANSPORTS = {
+    'httpx': 'proxypay.transports.AsyncHttpxTransport',
+    'fake': 'proxypay.transports.AsyncFakeTransport',
+}
+
+def get_transport_class(name, asynchronous=False):
+    """Transport class from a name of TRANSPORTS (or ASYNC_TRANSPORTS) or a dotted path"""
+    transports = ASYNC_TRANSPORTS if asynchronous else TRANSPORTS
+    return import_string(transports.get(name, name))
+
+def build_transport(conf, base_url, headers, asynchronous=False):
+    """Builds the transport configured by PROXYPAY['TRANSPORT'] or PROXYPAY['ASYNC_TRANSPORT']"""
+    if asynchronous:
+        name = conf.ASYNC_TRANSPORT or ('fake' if conf.TRANSPORT == 'fake' else 'httpx')
+    else:
+        name = conf.TRANSPORT
+    return get_transport_class(name, asynchronous)(
+        base_url,
+        headers,
+        timeout=conf.get_timeout(),
+        pool_size=conf.API_POOL_SIZE,
+        http2=conf.API_HTTP2
+    )
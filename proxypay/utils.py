@@ -46,13 +46,14 @@ def check_api_signature(signature, raw_http_body_msg, token=None):
 # ==============================================================================================
 
 def get_decimal_value(amount):
-    return Decimal('%.2f' & amount)
+    return Decimal('%.2f' % amount)
 
 # ==============================================================================================
 
 def get_calculated_fees(amount, fee: tuple, name: str = None, return_as_dict: bool = True):
     """
-    Calculates the fees for an amount.
+    Calculates the fees for an amount, with floats. See proxypay.fees for exact
+    Decimal fees, tiered fees and batches.
     fees must be a tuple containing the following values in the following order:
     The percentage rate, minimum amount to be withdrawn, maximum amount. like:
     (13, 100, 100) or
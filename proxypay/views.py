@@ -1,6 +1,9 @@
+import hmac
 import json
-from .references import get
+from . import metrics
 from .configs import conf
+from .models import InboxPayment
+from .payments import apply_payment
 from .utils import check_api_signature
 
 from django.http import HttpResponse
@@ -13,20 +16,32 @@ def watch_payments (request):
     """View to watch Proxyapy API Webhook"""
     if request.method == 'POST':
         if check_api_signature(request.headers.get('X-Signature'), request.body):
-            confirmed   = conf.ACCEPT_UNRECOGNIZED_PAYMENT
-            payment     = json.loads(request.body)
-            reference   = get(
-                # getting from uuid or reference id
-                payment.get('custom_fields', {}).get(conf.REFERENCE_UUID_KEY),
-                payment.get('reference_id')
-            )
+            if conf.WEBHOOK_INBOX:
+                # applied later by the inbox worker
+                InboxPayment.objects.create(payload=request.body.decode('utf-8'))
+                metrics.webhook('queued')
+                return HttpResponse(status=200)
             # check reference
-            if reference:
-                reference.paid(payment)
-                confirmed = True
-            #
-            if confirmed:
+            if apply_payment(json.loads(request.body)):
+                metrics.webhook('processed')
+                return HttpResponse(status=200)
+            metrics.webhook('unrecognized')
+            if conf.ACCEPT_UNRECOGNIZED_PAYMENT:
                 return HttpResponse(status=200)
             return HttpResponse(status=404)
+        metrics.webhook('rejected')
         return HttpResponse(status=403)
     return HttpResponse(status=405)
+
+# ==============================================================================================
+
+def metrics_view (request):
+    """Proxypay metrics in Prometheus text format, see proxypay.metrics"""
+    if conf.METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get('Authorization', ''), f"Bearer {conf.METRICS_TOKEN}"
+    ):
+        return HttpResponse(status=403)
+    return HttpResponse(
+        metrics.get_backend().render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
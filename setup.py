@@ -33,6 +33,9 @@ setuptools.setup(
         "requests>=2",
         "django-admin-display"
     ],
+    extras_require={
+        "async": ["httpx"],
+    },
     python_requires=">=3.8",
     classifiers=[
         "Environment :: Web Environment",
@@ -0,0 +1,24 @@
+from django.core.cache import caches
+from django.test import TransactionTestCase
+
+from proxypay import breaker, metrics
+from proxypay.transports import fake_proxypay
+
+# ==========================================================================================================
+
+class ProxypayTestCase(TransactionTestCase):
+
+    """
+    Test case starting from an empty fake Proxypay (reference ids, payments), empty caches
+    (reference cache, rate limit and circuit breaker state) and metrics.
+    TransactionTestCase, since payments and signals are applied on commit and from threads
+    """
+
+    def setUp(self):
+        super().setUp()
+        fake_proxypay.reset()
+        for cache in caches.all():
+            cache.clear()
+        metrics.get_backend().reset()
+        # state kept by the process
+        breaker.get_breaker().reset()
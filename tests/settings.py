@@ -0,0 +1,40 @@
+###
+##  Django Proxypay Tests Settings
+#
+#   Against the in memory fake Proxypay (PROXYPAY['TRANSPORT'] = 'fake') and a sqlite
+#   database file, so the concurrency tests get one connection per thread
+
+import os
+
+SECRET_KEY = 'tests'
+USE_TZ     = True
+
+INSTALLED_APPS = [
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'proxypay',
+]
+
+DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests.sqlite3')
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': DATABASE,
+        # concurrent writers wait for the lock instead of failing
+        'OPTIONS': {'timeout': 30},
+        # a file instead of the in memory database, shared by the threads of the tests
+        'TEST': {'NAME': DATABASE},
+    }
+}
+
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+PROXYPAY = {
+    'PRIVATE_KEY': 'tests',
+    'ENTITY': '12345',
+    'ENV': 'sandbox',
+    'TRANSPORT': 'fake',
+}
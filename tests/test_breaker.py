@@ -0,0 +1,108 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.test import override_settings
+
+from proxypay.api import AsyncProxypayAPI, ProxypayAPI
+from proxypay.breaker import CircuitBreaker
+from proxypay.exceptions import ProxypayCircuitOpen
+from proxypay.transports import Response, Transport
+
+from .base import ProxypayTestCase
+
+# ==========================================================================================================
+
+class UnavailableTransport(Transport):
+
+    """Proxypay answering 503 to every request"""
+
+    def __init__(self):
+        super().__init__('', {})
+        self.requests = 0
+
+    def request(self, method, path, json=None, params=None, timeout=None):
+        self.requests += 1
+        return Response(503)
+
+class AsyncUnavailableTransport(UnavailableTransport):
+
+    async def request(self, method, path, json=None, params=None, timeout=None):
+        return super().request(method, path, json=json, params=params, timeout=timeout)
+
+# ==========================================================================================================
+
+class CircuitBreakerTestCase(ProxypayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.breaker = CircuitBreaker('test', threshold=2)
+
+    def half_open(self):
+        """Opened breaker whose reset timeout elapsed"""
+        self.breaker.open()
+        self.breaker.cache.set(self.breaker.key('open_until'), time.time() - 1, 60)
+        self.breaker.open_until = self.breaker.checked_at = 0
+
+    def before_call_concurrently(self):
+        def before_call():
+            try:
+                return self.breaker.before_call()
+            except ProxypayCircuitOpen:
+                return None
+
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(before_call).result()
+
+    def test_trial_is_per_call(self):
+        self.half_open()
+        self.assertTrue(self.breaker.before_call())
+        # the other calls of the process fail fast during the trial
+        self.assertIsNone(self.before_call_concurrently())
+        # a call made before the breaker opened doesn't close it
+        self.breaker.record_success(False)
+        self.assertIsNotNone(self.breaker.cache.get(self.breaker.key('open_until')))
+        # the trial call does
+        self.breaker.record_success(True)
+        self.assertIsNone(self.breaker.cache.get(self.breaker.key('open_until')))
+        self.assertFalse(self.before_call_concurrently())
+
+    def test_failed_trial_reopens(self):
+        self.half_open()
+        self.assertTrue(self.breaker.before_call())
+        self.breaker.record_failure(True)
+        with self.assertRaises(ProxypayCircuitOpen):
+            self.breaker.before_call()
+
+# ==========================================================================================================
+
+@override_settings(PROXYPAY={
+    **settings.PROXYPAY, 'CIRCUIT_BREAKER': True, 'CIRCUIT_BREAKER_THRESHOLD': 3,
+    'API_RETRIES': 2, 'API_RETRY_BACKOFF': 0
+})
+class RequestFailuresTestCase(ProxypayTestCase):
+
+    """A request is counted once by the breaker, whatever its number of attempts"""
+
+    def test_request(self):
+        transport = UnavailableTransport()
+        api       = ProxypayAPI(transport=transport)
+        for _ in range(3):
+            self.assertEqual(api.request('GET', '/payments').status_code, 503)
+        self.assertEqual(transport.requests, 9)
+        with self.assertRaises(ProxypayCircuitOpen):
+            api.request('GET', '/payments')
+
+    def test_async_request(self):
+        transport = AsyncUnavailableTransport()
+        api       = AsyncProxypayAPI(transport=transport)
+
+        async def requests():
+            for _ in range(3):
+                self.assertEqual((await api.request('GET', '/payments')).status_code, 503)
+            self.assertEqual(transport.requests, 9)
+            with self.assertRaises(ProxypayCircuitOpen):
+                await api.request('GET', '/payments')
+
+        asyncio.run(requests())
@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import override_settings
+
+from proxypay.models import Reference
+from proxypay.references import cache, create, get
+from proxypay.transports import fake_proxypay
+
+from .base import ProxypayTestCase
+
+# ==========================================================================================================
+
+@override_settings(PROXYPAY={**settings.PROXYPAY, 'REFERENCE_CACHE': True})
+class ReferenceCacheTestCase(ProxypayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.reference = create(1000)
+
+    def get_concurrently(self, *args):
+        """Reference lookup from another thread, with its own connection"""
+
+        def lookup():
+            try:
+                return get(*args)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(lookup).result()
+
+    def test_paid_in_outer_transaction(self):
+        payment = fake_proxypay.add_payment(self.reference.reference, self.reference.amount)
+        with transaction.atomic():
+            self.assertTrue(Reference.objects.get(pk=self.reference.pk).paid(payment))
+            # not committed yet, the lookup reads the waiting reference and caches it
+            self.assertEqual(self.get_concurrently(self.reference.key).status, Reference.Status.WAITING)
+            self.assertEqual(self.get_concurrently(None, self.reference.reference).status, Reference.Status.WAITING)
+        # invalidated by the commit
+        self.assertEqual(get(self.reference.key).status, Reference.Status.PAID)
+        # reference ids only find waiting references
+        self.assertFalse(get(None, self.reference.reference))
+
+    def test_rolled_back(self):
+        payment = fake_proxypay.add_payment(self.reference.reference, self.reference.amount)
+        self.assertEqual(get(self.reference.key).status, Reference.Status.WAITING)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Reference.objects.get(pk=self.reference.pk).paid(payment)
+            raise RuntimeError
+        cache.reset_stats()
+        self.assertEqual(get(self.reference.key).status, Reference.Status.WAITING)
+        self.assertEqual(cache.stats()['hits'], 1)
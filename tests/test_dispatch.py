@@ -0,0 +1,83 @@
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.db import transaction
+from django.test import override_settings
+
+from proxypay import dispatch, metrics
+from proxypay.references import create, create_many
+from proxypay.signals import reference_created
+
+from .base import ProxypayTestCase
+
+# ==========================================================================================================
+
+def dispatch_mode(mode):
+    return override_settings(PROXYPAY={**settings.PROXYPAY, 'SIGNAL_DISPATCH': mode})
+
+def failing_receiver(sender, **kwargs):
+    raise ValueError('receiver error')
+
+class SignalDispatchTestCase(ProxypayTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.received = []
+        reference_created.connect(self.receiver)
+
+    def tearDown(self):
+        reference_created.disconnect(self.receiver)
+        reference_created.disconnect(failing_receiver)
+
+    def receiver(self, sender, reference, **kwargs):
+        self.received.append((reference.reference, threading.current_thread().name))
+
+    def get_durations(self):
+        return {
+            dict(labels)['receiver']: count
+            for (name, labels), (_buckets, _sum, count) in metrics.get_backend().snapshot()['histograms'].items()
+            if name == 'proxypay_signal_receiver_duration_seconds'
+        }
+
+    def test_sync(self):
+        with dispatch_mode('sync'), transaction.atomic():
+            reference = create(1000)
+            self.assertEqual(self.received, [(reference.reference, threading.current_thread().name)])
+        reference_created.connect(failing_receiver)
+        with dispatch_mode('sync'), self.assertRaises(ValueError):
+            create(1000)
+
+    def test_on_commit(self):
+        with dispatch_mode('on_commit'):
+            with transaction.atomic():
+                reference = create(1000)
+                self.assertEqual(self.received, [])
+            self.assertEqual(self.received, [(reference.reference, threading.current_thread().name)])
+            # rolled back, never sent
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                create(1000)
+                raise RuntimeError
+            self.assertEqual(len(self.received), 1)
+
+    def test_thread(self):
+        reference_created.connect(failing_receiver)
+        with dispatch_mode('thread'), self.assertLogs('proxypay.dispatch', 'ERROR'):
+            references, failures = create_many([{'amount': 1000}] * 3)
+            self.assertTrue(dispatch.flush(5))
+        self.assertEqual(failures, [])
+        self.assertEqual(
+            sorted(reference for reference, _thread in self.received),
+            sorted(reference.reference for reference in references)
+        )
+        self.assertTrue(all(thread.startswith('proxypay-dispatch') for _reference, thread in self.received))
+        # the batch is a single dispatch, timed once by receiver
+        self.assertEqual(self.get_durations()[dispatch.get_name(self.receiver)], 1)
+
+    def test_without_receivers_list(self):
+        reference_created.connect(failing_receiver)
+        with dispatch_mode('on_commit'), mock.patch.object(dispatch, 'get_receivers', return_value=None):
+            with self.assertLogs('proxypay.dispatch', 'ERROR'):
+                reference = create(1000)
+        self.assertEqual(self.received, [(reference.reference, threading.current_thread().name)])
+        self.assertEqual(self.get_durations(), {dispatch.ALL_RECEIVERS: 1})
@@ -0,0 +1,94 @@
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.utils.timezone import now
+
+from proxypay.models import DailyRevenue, InboxPayment, ProcessedPayment, Reference
+from proxypay.payments import apply_payment, drain_inbox, get_inbox_backoff
+from proxypay.references import create
+from proxypay.signals import reference_paid
+from proxypay.transports import fake_proxypay
+
+from .base import ProxypayTestCase
+
+# ==========================================================================================================
+
+class ConcurrentPaymentTestCase(ProxypayTestCase):
+
+    """The same payment applied concurrently (webhook retries, check_payment) is applied once"""
+
+    threads = 16
+
+    def setUp(self):
+        super().setUp()
+        self.reference = create(1000)
+        self.payment   = fake_proxypay.add_payment(self.reference.reference, self.reference.amount, self.reference.fields)
+        self.signals   = []
+        self.lock      = threading.Lock()
+        reference_paid.connect(self.receiver)
+
+    def tearDown(self):
+        reference_paid.disconnect(self.receiver)
+
+    def receiver(self, sender, reference, **kwargs):
+        with self.lock:
+            self.signals.append(reference.pk)
+
+    def run_concurrently(self, apply):
+        barrier = threading.Barrier(self.threads)
+
+        def work(_index):
+            try:
+                barrier.wait()
+                return apply()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.threads) as executor:
+            return list(executor.map(work, range(self.threads)))
+
+    def assertAppliedOnce(self):
+        self.assertEqual(ProcessedPayment.objects.filter(payment_id=self.payment['id']).count(), 1)
+        self.assertEqual(self.signals, [self.reference.pk])
+        reference = Reference.objects.get(pk=self.reference.pk)
+        self.assertEqual(reference.status, Reference.Status.PAID)
+        self.assertEqual(reference.payment['id'], self.payment['id'])
+        self.assertEqual(sum(revenue.paid_count for revenue in DailyRevenue.objects.all()), 1)
+
+    def test_apply_payment(self):
+        results = self.run_concurrently(lambda: apply_payment(self.payment))
+        # every call finds the reference, the payment is applied once
+        self.assertTrue(all(results))
+        self.assertAppliedOnce()
+
+    def test_paid(self):
+        results = self.run_concurrently(lambda: Reference.objects.get(pk=self.reference.pk).paid(self.payment))
+        self.assertEqual(results.count(True), 1)
+        self.assertAppliedOnce()
+
+# ==========================================================================================================
+
+class InboxRetryTestCase(ProxypayTestCase):
+
+    """A failing inbox payment is not retried before its exponential backoff"""
+
+    def test_backoff(self):
+        entry = InboxPayment.objects.create(payload='not json')
+
+        self.assertEqual(drain_inbox(), 1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.attempts, 1)
+        self.assertIsNone(entry.processed_at)
+        first = entry.retry_at - now()
+        self.assertTrue(datetime.timedelta(0) < first <= datetime.timedelta(seconds=get_inbox_backoff(1)))
+
+        # backing off
+        self.assertEqual(drain_inbox(), 0)
+
+        InboxPayment.objects.filter(pk=entry.pk).update(retry_at=now())
+        self.assertEqual(drain_inbox(), 1)
+        entry.refresh_from_db()
+        self.assertEqual(entry.attempts, 2)
+        self.assertGreater(entry.retry_at - now(), first)
@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+
+from proxypay.models import ReferenceId
+from proxypay.references import pool
+from proxypay.transports import fake_proxypay
+
+from .base import ProxypayTestCase
+
+# ==========================================================================================================
+
+@override_settings(PROXYPAY={**settings.PROXYPAY, 'REFERENCE_ID_POOL': True, 'REFERENCE_ID_POOL_HIGH_WATERMARK': 50})
+class ReferenceIdPoolTestCase(ProxypayTestCase):
+
+    def test_concurrent_refills(self):
+        """Workers crossing the low watermark together reserve a single pool"""
+
+        workers = 8
+        barrier = threading.Barrier(workers)
+
+        def refill(_index):
+            try:
+                barrier.wait()
+                return pool.refill()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(workers) as executor:
+            added = list(executor.map(refill, range(workers)))
+        self.assertEqual(sum(added), 50)
+        self.assertEqual(ReferenceId.objects.count(), 50)
+        # reference ids reserved from Proxypay
+        self.assertEqual(next(fake_proxypay.reference_ids), 100000050)
+
+    def test_refill_up_to_size(self):
+        self.assertEqual(pool.refill(10), 10)
+        self.assertEqual(pool.refill(10), 0)
+        self.assertEqual(pool.refill(), 40)
@@ -0,0 +1,46 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from proxypay.exceptions import ProxypayRateLimited
+from proxypay.ratelimit import TokenBucket
+
+from .base import ProxypayTestCase
+
+# ==========================================================================================================
+
+class TokenBucketTestCase(ProxypayTestCase):
+
+    def reserve_concurrently(self, bucket, calls, max_wait):
+        barrier = threading.Barrier(calls)
+
+        def reserve(_index):
+            barrier.wait()
+            try:
+                return round(bucket.reserve(max_wait), 6)
+            except ProxypayRateLimited:
+                return None
+
+        with ThreadPoolExecutor(calls) as executor:
+            return list(executor.map(reserve, range(calls)))
+
+    @mock.patch('proxypay.ratelimit.time.time', return_value=1000.0)
+    def test_concurrent_calls_get_one_slot_each(self, _time):
+        # 4 calls every 0.4s
+        waits = self.reserve_concurrently(TokenBucket('test', 10, 4), 16, max_wait=0.5)
+        self.assertEqual(sorted(waits, key=lambda wait: -1 if wait is None else wait), [None] * 8 + [0] * 4 + [0.4] * 4)
+
+    @mock.patch('proxypay.ratelimit.time.time', return_value=1000.0)
+    def test_fail(self, _time):
+        waits = self.reserve_concurrently(TokenBucket('test', 10, 4), 16, max_wait=0)
+        self.assertEqual(waits.count(0), 4)
+        self.assertEqual(waits.count(None), 12)
+
+    def test_next_window(self):
+        bucket = TokenBucket('test', 10, 2)
+        with mock.patch('proxypay.ratelimit.time.time', return_value=1000.1):
+            self.assertEqual([round(bucket.reserve(1), 6) for _ in range(3)], [0, 0, 0.1])
+        with mock.patch('proxypay.ratelimit.time.time', return_value=1000.2):
+            # the slot taken by the waiting call is counted
+            self.assertEqual(bucket.reserve(1), 0)
+            self.assertAlmostEqual(bucket.reserve(1), 0.2)
@@ -0,0 +1,86 @@
+import datetime
+
+from django.utils.timezone import now
+
+from proxypay.configs import conf
+from proxypay.models import DailyRevenue, ProcessedPayment, Reference
+from proxypay.payments import apply_payment, reconcile
+from proxypay.references import create
+from proxypay.transports import fake_proxypay
+
+from .base import ProxypayTestCase
+
+# ==========================================================================================================
+
+class PaymentMatchingTestCase(ProxypayTestCase):
+
+    """A payment is matched to the same reference by the webhook (apply_payment) and by reconcile"""
+
+    def webhook(self, payment):
+        return apply_payment(payment)
+
+    def reconcile(self, payment):
+        return payment in reconcile([payment])['matched']
+
+    def assertSameResult(self, scenario):
+        """
+        Builds the scenario (returns the payment and the references by name) for each path,
+        and compares whether the payment is recognized and which reference it pays
+        """
+
+        results = []
+        for path in (self.webhook, self.reconcile):
+            Reference.objects.all().delete()
+            ProcessedPayment.objects.all().delete()
+            DailyRevenue.objects.all().delete()
+            fake_proxypay.reset()
+            payment, references = scenario()
+            recognized = path(payment)
+            names = {reference.pk: name for name, reference in references.items()}
+            paid = [
+                names[reference.pk] for reference in Reference.objects.filter(status=Reference.Status.PAID)
+                if reference.payment.get('id') == payment['id']
+            ]
+            results.append((recognized, paid))
+        self.assertEqual(results[0], results[1])
+        return results[0]
+
+    def pay(self, reference, **kwargs):
+        return fake_proxypay.add_payment(reference.reference, reference.amount, {**reference.fields, **kwargs})
+
+    # --------------------------------------------------------------------------------------------
+
+    def test_by_key(self):
+        def scenario():
+            reference = create(1000)
+            return self.pay(reference), {'reference': reference}
+        self.assertEqual(self.assertSameResult(scenario), (True, ['reference']))
+
+    def test_by_reference_id(self):
+        def scenario():
+            reference = create(1000)
+            return self.pay(reference, **{conf.REFERENCE_UUID_KEY: None}), {'reference': reference}
+        self.assertEqual(self.assertSameResult(scenario), (True, ['reference']))
+
+    def test_expired_by_reference_id(self):
+        def scenario():
+            reference = create(1000)
+            Reference.objects.filter(pk=reference.pk).update(expires_in=now() - datetime.timedelta(hours=1))
+            return fake_proxypay.add_payment(reference.reference, reference.amount, {}), {'reference': reference}
+        self.assertEqual(self.assertSameResult(scenario), (False, []))
+
+    def test_key_of_reference_paid_by_another_payment(self):
+        def scenario():
+            first = create(1000)
+            apply_payment(self.pay(first))
+            # reference id reused by Proxypay for a new reference
+            second = create(1000)
+            Reference.objects.filter(pk=second.pk).update(reference=first.reference)
+            return self.pay(first), {'first': first, 'second': second}
+        self.assertEqual(self.assertSameResult(scenario), (True, ['second']))
+
+    def test_unknown(self):
+        def scenario():
+            reference = create(1000)
+            return fake_proxypay.add_payment('999999999', 1000, {}), {'reference': reference}
+        self.assertEqual(self.assertSameResult(scenario), (False, []))
@@ -0,0 +1,53 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.db.models import Sum
+
+from proxypay import rollups
+from proxypay.models import DailyRevenue, Reference
+from proxypay.references import create
+from proxypay.transports import fake_proxypay
+
+from .base import ProxypayTestCase
+
+# ==========================================================================================================
+
+class RebuildTestCase(ProxypayTestCase):
+
+    """Payments made while the rollup is rebuilt are counted once"""
+
+    def pay(self, reference):
+        payment = fake_proxypay.add_payment(reference.reference, reference.amount, reference.fields)
+        return reference.paid(payment)
+
+    def test_concurrent_payments(self):
+        references = [create(1000 + index) for index in range(40)]
+        for reference in references[:20]:
+            self.pay(reference)
+
+        started = threading.Barrier(2)
+
+        def rebuild():
+            try:
+                started.wait()
+                # one query by reference, a long rebuild
+                return rollups.rebuild(chunk_size=1)
+            finally:
+                connection.close()
+
+        def pay():
+            try:
+                started.wait()
+                return [self.pay(reference) for reference in references[20:]]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(2) as executor:
+            rebuilt, paid = executor.submit(rebuild), executor.submit(pay)
+            rebuilt.result()
+            self.assertTrue(all(paid.result()))
+
+        totals = DailyRevenue.objects.aggregate(paid_count=Sum('paid_count'), amount=Sum('amount'))
+        self.assertEqual(totals['paid_count'], 40)
+        self.assertEqual(totals['amount'], Reference.objects.aggregate(amount=Sum('amount'))['amount'])